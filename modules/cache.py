@@ -0,0 +1,124 @@
+import json
+import time
+from collections import OrderedDict
+from os import getenv
+from threading import Lock
+from distutils.util import strtobool
+from spex_common.modules.database import db_instance
+from spex_common.modules.logging import get_logger
+import services.Indexes as IndexesService
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = get_logger('spex.backend')
+
+_redis = None
+
+# without redis the versions live in arango, every worker process has to see a bump
+versions_collection = 'cache_versions'
+
+version_query = f' RETURN DOCUMENT("{versions_collection}", @key).version || 0 '
+
+bump_query = ' FOR key IN @keys ' \
+    ' UPSERT { _key: key } ' \
+    ' INSERT { _key: key, version: 1 } ' \
+    f' UPDATE {{ version: OLD.version + 1 }} IN {versions_collection} '
+
+
+def redis_instance():
+    global _redis
+
+    if _redis is not None:
+        return _redis or None
+
+    _redis = False
+    if redis is None or not strtobool(getenv('CACHE_REDIS', 'False')):
+        return None
+
+    try:
+        client = redis.Redis(
+            host=getenv('REDIS_HOST'),
+            port=int(getenv('REDIS_PORT', 6379)),
+            password=getenv('REDIS_PASSWORD') or None
+        )
+        client.ping()
+        _redis = client
+    except Exception as error:
+        logger.warning(f'shared cache is disabled: {error}')
+
+    return _redis or None
+
+
+class VersionedCache:
+    # values are stored as json, so every hit returns a fresh copy;
+    # values are kept per process, the versions that invalidate them are shared
+
+    def __init__(self, name, size=256, ttl=30):
+        self.name = name
+        self.size = size
+        self.ttl = ttl
+        self._lock = Lock()
+        self._items = OrderedDict()
+
+    def _version_key(self, key):
+        return f'{self.name}:version:{key}'
+
+    def version(self, key):
+        if client := redis_instance():
+            return int(client.get(self._version_key(key)) or 0)
+
+        IndexesService.ensure_collection(versions_collection)
+        result = db_instance().query(version_query, key=self._version_key(key))
+        return int(result[0]) if result else 0
+
+    def bump(self, *keys):
+        keys = [self._version_key(str(key)) for key in keys if key]
+        if not keys:
+            return
+
+        if client := redis_instance():
+            for key in keys:
+                client.incr(key)
+            return
+
+        IndexesService.ensure_collection(versions_collection)
+        db_instance().query(bump_query, keys=keys)
+
+    def get(self, key, variant, loader):
+        key = str(key)
+        item_key = f'{self.name}:{key}:{self.version(key)}:{variant}'
+
+        with self._lock:
+            if item := self._items.get(item_key):
+                expires, value = item
+                if expires > time.time():
+                    self._items.move_to_end(item_key)
+                    return json.loads(value)
+                del self._items[item_key]
+
+        client = redis_instance()
+        value = None
+        if client:
+            try:
+                value = client.get(item_key)
+            except Exception as error:
+                logger.warning(error)
+
+        if value is None:
+            value = json.dumps(loader())
+            if client:
+                try:
+                    client.set(item_key, value, ex=self.ttl)
+                except Exception as error:
+                    logger.warning(error)
+
+        with self._lock:
+            self._items[item_key] = (time.time() + self.ttl, value)
+            self._items.move_to_end(item_key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+        return json.loads(value)
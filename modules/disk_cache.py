@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+from spex_common.modules.logging import get_logger
+
+logger = get_logger('spex.backend')
+
+
+class DiskCache:
+    # files on local disk with a byte budget, least recently used entries go first.
+    # every worker process shares the folder, so the budget is checked against the
+    # folder itself and recency is the file access time, not a per process index
+
+    def __init__(self, folder, budget, max_entry=None, scan_interval=60):
+        self.folder = folder
+        self.budget = budget
+        self.max_entry = max_entry or budget
+        self.scan_interval = scan_interval
+        self._lock = Lock()
+        # bytes found by the last scan plus what this process stored since
+        self._bytes = 0
+        self._since = 0
+        self._entries = 0
+        self._scanned = None
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'skipped': 0}
+        os.makedirs(folder, exist_ok=True)
+        with self._lock:
+            self._scan()
+
+    @staticmethod
+    def digest(*parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _path(self, digest):
+        return os.path.join(self.folder, digest[:2], digest)
+
+    def _scan(self):
+        # the real size of the folder, evicting the oldest accessed entries over the budget;
+        # called with the lock held
+        found = []
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith('.json') or '.tmp' in name:
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                found.append((stat.st_atime, name, stat.st_size))
+
+        total = sum(size for _, _, size in found)
+        # down to 90% of the budget, so the next stores do not scan again at once
+        target = self.budget * 0.9 if total > self.budget else self.budget
+        found.sort()
+        while found and total > target:
+            _, name, size = found.pop(0)
+            total -= size
+            self.counters['evictions'] += 1
+            for path in (self._path(name), f'{self._path(name)}.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        self._bytes = total
+        self._since = 0
+        self._entries = len(found)
+        self._scanned = time.monotonic()
+
+    def get(self, digest):
+        # returns (meta, file) or None, the caller closes the file;
+        # an entry another process evicted is a miss, an open file stays readable
+        path = self._path(digest)
+        try:
+            with open(f'{path}.json', encoding='utf-8') as file:
+                meta = json.load(file)
+            body = open(path, 'rb')
+        except (OSError, ValueError):
+            with self._lock:
+                self.counters['misses'] += 1
+            return None
+
+        with self._lock:
+            self.counters['hits'] += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return meta, body
+
+    def writer(self, digest, meta):
+        return _Writer(self, digest, meta)
+
+    def _stored(self, digest, size):
+        with self._lock:
+            self.counters['stores'] += 1
+            self._bytes += size
+            self._since += size
+            self._entries += 1
+            # other processes store too, so a tenth of the budget written here is enough to look again
+            if self._bytes > self.budget or self._since > self.budget / 10 \
+                    or time.monotonic() - self._scanned > self.scan_interval:
+                self._scan()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'entries': self._entries,
+                'bytes': self._bytes,
+                'budget': self.budget,
+            }
+
+
+class _Writer:
+    # collects a body while it is streamed, the entry appears only when complete
+
+    def __init__(self, cache, digest, meta):
+        self.cache = cache
+        self.digest = digest
+        self.meta = meta
+        self.size = 0
+        path = cache._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.tmp = f'{path}.{os.getpid()}.tmp'
+        self.file = open(self.tmp, 'wb')
+
+    def write(self, chunk):
+        if self.file is None:
+            return
+        self.size += len(chunk)
+        if self.size > self.cache.max_entry:
+            self.cache.counters['skipped'] += 1
+            self.abort()
+            return
+        self.file.write(chunk)
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            try:
+                os.remove(self.tmp)
+            except OSError:
+                pass
+
+    def commit(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+
+        path = self.cache._path(self.digest)
+        try:
+            with open(f'{path}.json', 'w', encoding='utf-8') as file:
+                json.dump(self.meta, file)
+            os.replace(self.tmp, path)
+        except OSError as error:
+            logger.warning(f'response is not cached: {error}')
+            self.abort()
+            return
+
+        self.cache._stored(self.digest, self.size)
@@ -1,6 +1,9 @@
 import spex_common.services.History as HistService
+import services.Query as QueryService
+import services.HistoryQuery as HistoryQueryService
+import services.HistoryWriter as HistoryWriterService
 from flask_restx import Namespace, Resource
-from flask import request, abort
+from flask import request, abort, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from .models import history as _history
 from .models import responses
@@ -15,6 +18,7 @@ namespace.add_model(_history.a_history_response.name, _history.a_history_respons
 namespace.add_model(responses.error_response.name, responses.error_response)
 namespace.add_model(_history.list_history_response.name, _history.list_history_response)
 namespace.add_model(_history.history_get_model.name, _history.history_get_model)
+namespace.add_model(_history.history_parent_model.name, _history.history_parent_model)
 
 
 # history result
@@ -66,7 +70,7 @@ class HistoryResPost(Resource):
 
         return {'success': True, 'data': history.to_json()}, 200
 
-    @namespace.doc('history/getmany', security='Bearer')
+    @namespace.doc('history/getmany', security='Bearer', params=HistoryQueryService.params)
     # @namespace.marshal_with(_history.list_history_response)
     # @namespace.response(200, 'list history current user', _history.list_history_response)
     @namespace.response(404, 'history not found', responses.error_response)
@@ -74,24 +78,62 @@ class HistoryResPost(Resource):
     @jwt_required()
     def get(self):
         author = get_jwt_identity()
-        result = HistService.select_history()
+        result, cursor = HistoryQueryService.select(
+            author,
+            QueryService.page_args(always=True),
+            HistoryQueryService.filter_args()
+        )
 
-        if result is None:
-            abort(404, 'history not found')
+        return {'success': True, 'data': result, 'cursor': cursor}, 200
 
-        return {'success': True, 'data': result}, 200
+
+@namespace.route('/export')
+class HistoryResExport(Resource):
+    @namespace.doc('history/export', security='Bearer', params=HistoryQueryService.params)
+    @namespace.produces(['application/x-ndjson'])
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @jwt_required()
+    def get(self):
+        author = get_jwt_identity()
+        rows = HistoryQueryService.export(
+            author,
+            QueryService.page_args(always=True),
+            HistoryQueryService.filter_args()
+        )
+
+        return Response(stream_with_context(rows), 200, mimetype='application/x-ndjson')
+
+
+@namespace.route('/writer')
+class HistoryWriterStats(Resource):
+    @namespace.doc('history/writer', security='Bearer')
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @jwt_required()
+    def get(self):
+        return {'success': True, 'data': HistoryWriterService.stats()}, 200
 
 
 @namespace.route('/get_by_parent')
 class HistoryResGet(Resource):
-    @namespace.doc('history/getone/parent_id', security='Bearer')
+    @namespace.doc('history/getone/parent_id', security='Bearer', params=QueryService.params)
+    @namespace.expect(_history.history_parent_model)
     @namespace.response(404, 'history not found', responses.error_response)
     @namespace.response(401, 'Unauthorized', responses.error_response)
     @namespace.marshal_with(_history.a_history_response)
     @jwt_required()
     def post(self):
-        history = HistService.select_history(**request.json)
-        if history is None:
-            abort(404, 'history not found')
+        body = request.json
+        if not isinstance(body, dict):
+            abort(400, 'wrong body')
+
+        filters = HistoryQueryService.filter_args(body)
+        if 'parent' not in filters:
+            abort(400, 'parent is required')
+
+        history, cursor = HistoryQueryService.select(
+            get_jwt_identity(),
+            QueryService.page_args(always=True),
+            filters
+        )
 
-        return {'success': True, 'data': history}, 200
+        return {'success': True, 'data': history, 'cursor': cursor}, 200
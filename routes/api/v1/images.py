@@ -1,15 +1,15 @@
-from spex_common.services.Utils import download_file, del_file, copy_file
 import spex_common.services.Image as ImageService
+import services.Query as QueryService
+import services.Downloads as DownloadsService
+import services.ImageStore as ImageStoreService
+import services.ImageRepository as ImageRepositoryService
+import services.ImageMetadata as ImageMetadataService
+import services.Pyramid as PyramidService
 from flask_restx import Namespace, Resource
-from flask import request
+from flask import request, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from .models import image
 from .models import responses
-import spex_common.modules.omeroweb as omeroweb
-import os
-from datetime import date
-from spex_common.modules.database import db_instance
-from spex_common.models.Image import image as im
 
 
 namespace = Namespace('Images', description='image download and cache in our data storage CRUD operations')
@@ -18,41 +18,12 @@ namespace.add_model(image.image_model.name, image.image_model)
 namespace.add_model(image.image_get_model.name, image.image_get_model)
 namespace.add_model(image.a_images_response.name, image.a_images_response)
 namespace.add_model(image.list_images_response.name, image.list_images_response)
+namespace.add_model(image.download_model.name, image.download_model)
+namespace.add_model(image.a_download_response.name, image.a_download_response)
 namespace.add_model(responses.response.name, responses.response)
 namespace.add_model(responses.error_response.name, responses.error_response)
 
 
-def image_by_id_format(id, format):
-    # ' RETURN { _key: doc._key, name: doc.name, omeroId: doc.omeroId, paths: [path]} '
-    image = ImageService.select_images(omeroId=id)
-    if image is not None:
-        query = ' FOR doc IN images ' + \
-            f' FILTER doc.omeroId == "{id}" ' + \
-                ' FOR path IN doc.paths ' + \
-            f' FILTER path.format == "{format}" ' + \
-                ' LIMIT 1 ' + \
-                ' RETURN doc '
-        result = db_instance().query(query)
-
-        if len(result) > 0:
-            image = im(result[0]).to_json()
-        else:
-            image = None
-        return image
-    else:
-        return None
-
-
-def del_data_fromImg(data, format):
-    pathToResponce = []
-    if data.get('paths') is not None:
-        for path in data['paths']:
-            if path['format'] == format:
-                pathToResponce.append(path)
-    data.update({'paths': pathToResponce})
-    return data
-
-
 @namespace.route('/<string:id>')
 @namespace.param('id', 'omero image id')
 class ImgGetDel(Resource):
@@ -63,14 +34,13 @@ class ImgGetDel(Resource):
     @namespace.marshal_with(image.a_images_response)
     @jwt_required()
     def delete(self, id):
-        image = ImageService.select_images(omeroId=id)
-        image = image[0] if image is not None else None
+        image = ImageRepositoryService.find(id)
         if image is None:
             return {'success': False, 'message': 'Image not found'}, 200
         else:
-            for path in image.get('paths'):
-                print(del_file(path.get('path')))
-                break
+            # store bytes are freed only when no user copy or other image links them
+            for path in image.get('paths') or []:
+                ImageStoreService.remove(path.get('path'), path.get('blob'))
         deleted = ImageService.delete(id)
         if deleted is None:
             return {'success': False, 'message': 'cannot delete'}, 200
@@ -78,9 +48,10 @@ class ImgGetDel(Resource):
             return {'success': True, 'data': deleted}, 200
 
     @namespace.doc('image/getone', security='Bearer')
-    @namespace.param('download', 'Try to download True False')
+    @namespace.param('download', 'Start a background download True False, poll /images/downloads/<id>')
     @namespace.param('format', 'file format JPEG/PNG/TIF default TIF')
     @namespace.param('copy', 'Copy to user folder true false', required=False)
+    @namespace.param('size', 'longest side in px of a downscaled copy', required=False)
     @namespace.response(200, 'image by id', image.a_images_response)
     @namespace.response(404, 'Image not found', responses.error_response)
     @namespace.response(401, 'Unauthorized', responses.error_response)
@@ -100,61 +71,236 @@ class ImgGetDel(Resource):
                 pass
             else:
                 return {'success': False, 'message': 'format error tif/png/jpeg'}, 200
-        image = image_by_id_format(id, format)
-        im_without_format = ImageService.select_images(omeroId=id)
-        im_without_format = im_without_format[0] if im_without_format is not None else None
+
+        side = request.args.get('size')
+        if side is not None:
+            if not side.isdigit() or int(side) <= 0:
+                return {'success': False, 'message': 'size must be a positive number'}, 200
+            side = int(side)
 
         if download is True:
-            session = omeroweb.get(author['login'])
-            path = os.getenv('OMERO_WEB') + '/webclient/render_image_download/' + str(id) + '/?format=' + format
-            relativePath = download_file(path, client=session, imgId=id)
-            if relativePath is not None:
-                if copy:
-                    copy_file(_path=relativePath, author=author)
-                path = {'path': relativePath, 'format': format, 'date': date.today().isoformat()}
-                if image is not None:
-                    for path in image['paths']:
-                        if path.get('format') == format:
-                            path['path'] = relativePath
-                            path['date'] = date.today().isoformat()
-                    image = ImageService.update(id, image).to_json()
-                elif image is None and im_without_format is not None:
-                    image = im_without_format
-                    if image.get('paths') is not None:
-                        image['paths'].append(path)
-                    else:
-                        image.update({'paths': [path]})
-                    image = ImageService.update(id, image).to_json()
-                else:
-                    (filename, ext) = os.path.splitext(os.path.basename(relativePath))
-                    data = {'name': filename, 'omeroId': id, 'paths': [path]}
-                    image = ImageService.insert(data).to_json()
-            else:
-                if image is not None:
-                    return {'success': True, 'data': del_data_fromImg(image, format)}, 200
-        else:
-            image = ImageService.select_images(omeroId=id)
-            image = image[0] if image is not None else None
-            if image is None:
-                return {'success': False, 'message': "image not found"}, 200
-            image = del_data_fromImg(image.to_json(), format)
-            if len(image.get('paths')) == 0:
-                return {'success': False, 'message': "image not found"}, 200
+            # only the full resolution tif comes from omero, the rest is converted from it
+            job = DownloadsService.submit(id, format, author, copy=copy, side=side)
+            if job is None:
+                return {'success': False, 'message': 'Unauthorized'}, 401
+
+            # the current copy, if any, is returned while the download runs
+            image = ImageRepositoryService.find(id, format)
+            return {'success': True, 'data': image, 'download': DownloadsService.to_json(job)}, 200
+
+        image = ImageRepositoryService.find(id, format)
+        if image is None:
+            return {'success': False, 'message': "image not found"}, 200
+
+        return {'success': True, 'data': image}, 200
+
+
+@namespace.route('/<string:id>/metadata')
+@namespace.param('id', 'omero image id')
+class ImgMetadata(Resource):
+    @namespace.doc('image/metadata', security='Bearer')
+    @namespace.response(404, 'Metadata not found', responses.error_response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @jwt_required()
+    def get(self, id):
+        metadata = ImageMetadataService.get(id)
+        if metadata is None:
+            return {'success': False, 'message': 'Metadata not found'}, 404
+
+        return {'success': True, 'data': metadata}, 200
+
+
+@namespace.route('/search')
+class ImgSearch(Resource):
+    @namespace.doc('image/search', security='Bearer', params={
+        'dtype': 'pixel type, uint8/uint16/float32',
+        'channel': 'channel name',
+        'channels': 'number of channels',
+        'min_x': 'smallest width in px',
+        'min_y': 'smallest height in px',
+        'limit': 'page size',
+    })
+    @namespace.response(400, 'Wrong filter', responses.error_response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @jwt_required()
+    def get(self):
+        args = request.args
+        numbers = {}
+        for name in ('channels', 'min_x', 'min_y', 'limit'):
+            if (value := args.get(name)) is not None:
+                if not value.isdigit():
+                    return {'success': False, 'message': f'{name} must be a number'}, 400
+                numbers[name] = int(value)
+
+        numbers['limit'] = min(numbers.get('limit', QueryService.max_limit), QueryService.max_limit)
+        result = ImageRepositoryService.search(
+            dtype=args.get('dtype'),
+            channel=args.get('channel'),
+            **numbers
+        )
 
-        return {'success': True, 'data': del_data_fromImg(image, format)}, 200
+        return {'success': True, 'data': result}, 200
+
+
+@namespace.route('/metadata/backfill')
+class ImgMetadataBackfill(Resource):
+    @namespace.doc('image/metadata/backfill', security='Bearer')
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @jwt_required()
+    def post(self):
+        started = ImageMetadataService.start_backfill()
+
+        return {'success': True, 'started': started}, 200
+
+
+render_params = {
+    'c': 'comma separated channel indexes, up to three, default the first three',
+    'min': 'comma separated window start per channel, default the channel minimum',
+    'max': 'comma separated window end per channel, default the channel maximum',
+    'plane': 'z plane, default 0',
+}
+
+
+def _int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _render(id, draw):
+    # draw(folder, manifest, channels) returns planes or None outside of the image
+    plane = _int_arg('plane', 0)
+    if plane is None or plane < 0:
+        return {'success': False, 'message': 'plane must be a positive number'}, 400
+
+    state, folder, info = PyramidService.manifest(id, plane)
+    if state == 'missing':
+        return {'success': False, 'message': 'download the tif first'}, 404
+    if state != 'ready':
+        return {'success': state != 'error', 'message': f'pyramid is {state}'}, 202 if state == 'building' else 500
+
+    try:
+        channels = [int(c) for c in request.args.get('c', '').split(',') if c != '']
+        channels = channels or list(range(min(info['channels'], 3)))
+        low = [float(v) for v in request.args.get('min', '').split(',') if v != '']
+        high = [float(v) for v in request.args.get('max', '').split(',') if v != '']
+    except ValueError:
+        return {'success': False, 'message': 'c, min and max must be numbers'}, 400
+
+    if len(channels) > 3 or any(c < 0 or c >= info['channels'] for c in channels):
+        return {'success': False, 'message': f'up to three channels of {info["channels"]}'}, 400
+
+    windows = [
+        (low[i] if i < len(low) else info['range'][c][0], high[i] if i < len(high) else info['range'][c][1])
+        for i, c in enumerate(channels)
+    ]
+
+    planes = draw(folder, info, channels)
+    if planes is None:
+        return {'success': False, 'message': 'outside of the image'}, 404
+
+    response = send_file(PyramidService.render(planes, windows), mimetype='image/png')
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+
+@namespace.route('/<string:id>/tiles/<int:z>/<int:x>/<int:y>')
+@namespace.param('id', 'omero image id')
+class ImgTile(Resource):
+    @namespace.doc('image/tile', security='Bearer', params=render_params)
+    @namespace.produces(['image/png'])
+    @namespace.response(202, 'pyramid is building')
+    @namespace.response(404, 'no local tif or tile outside of the image', responses.error_response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @jwt_required(locations=['headers', 'cookies'])
+    def get(self, id, z, x, y):
+        return _render(id, lambda folder, info, channels: PyramidService.tile(folder, info, z, x, y, channels))
+
+
+@namespace.route('/<string:id>/region')
+@namespace.param('id', 'omero image id')
+class ImgRegion(Resource):
+    @namespace.doc('image/region', security='Bearer', params={
+        **render_params,
+        'zoom': 'zoom level, 0 is the whole image in one tile, default the full resolution',
+        'x': 'left in px of the zoom level',
+        'y': 'top in px of the zoom level',
+        'w': 'width in px',
+        'h': 'height in px',
+    })
+    @namespace.produces(['image/png'])
+    @namespace.response(202, 'pyramid is building')
+    @namespace.response(400, 'Wrong region', responses.error_response)
+    @namespace.response(404, 'no local tif or region outside of the image', responses.error_response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @jwt_required(locations=['headers', 'cookies'])
+    def get(self, id):
+        values = {name: _int_arg(name) for name in ('x', 'y', 'w', 'h')}
+        if any(value is None for value in values.values()):
+            return {'success': False, 'message': 'x, y, w and h are required numbers'}, 400
+        if values['w'] * values['h'] > PyramidService.max_region:
+            return {'success': False, 'message': f'region is larger than {PyramidService.max_region} px'}, 400
+
+        def draw(folder, info, channels):
+            zoom = _int_arg('zoom', len(info['levels']) - 1)
+            if zoom is None:
+                return None
+            return PyramidService.region(
+                folder, info, zoom, values['x'], values['y'], values['w'], values['h'], channels
+            )
+
+        return _render(id, draw)
+
+
+@namespace.route('/downloads/<string:handle>')
+@namespace.param('handle', 'download id')
+class ImgDownload(Resource):
+    @namespace.doc('image/download/status', security='Bearer')
+    @namespace.response(404, 'Download not found', responses.error_response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @namespace.marshal_with(image.a_download_response)
+    @jwt_required()
+    def get(self, handle):
+        job = DownloadsService.status(handle)
+        if job is None:
+            return {'success': False, 'message': 'Download not found'}, 404
+
+        return {'success': True, 'data': DownloadsService.to_json(job)}, 200
+
+    @namespace.doc('image/download/cancel', security='Bearer')
+    @namespace.response(404, 'Download not found', responses.error_response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @namespace.marshal_with(image.a_download_response)
+    @jwt_required()
+    def delete(self, handle):
+        job = DownloadsService.cancel(handle)
+        if job is None:
+            return {'success': False, 'message': 'Download not found'}, 404
+
+        return {'success': True, 'data': DownloadsService.to_json(job)}, 200
 
 
 @namespace.route('/')
 class ImagesGet(Resource):
-    @namespace.doc('image/getall', security='Bearer')
+    @namespace.doc('image/getall', security='Bearer', params=QueryService.params)
     @namespace.response(200, 'images', image.list_images_response)
     @namespace.response(404, 'Images not found', responses.error_response)
     @namespace.response(401, 'Unauthorized', responses.error_response)
     @namespace.marshal_with(image.list_images_response)
     @jwt_required()
     def get(self):
-        images = ImageService.select_images()
+        cursor = None
+
+        if (args := QueryService.page_args()) is not None:
+            images, cursor = QueryService.page('images', args)
+        else:
+            images = ImageService.select_images()
+
         if images is None:
             return {'success': False, 'message': 'Images not found'}, 200
         else:
-            return {'success': True, 'data': images}, 200
+            return {'success': True, 'data': images, 'cursor': cursor}, 200
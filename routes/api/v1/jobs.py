@@ -1,6 +1,10 @@
 import spex_common.services.Job as JobService
 import spex_common.services.Task as TaskService
 import spex_common.services.Script as ScriptService
+import services.PipelineCache as PipelineCacheService
+import services.Counters as CountersService
+import services.Query as QueryService
+import services.HistoryWriter as HistoryWriterService
 from spex_common.models.Status import TaskStatus
 from flask_restx import Namespace, Resource
 from flask import request
@@ -37,30 +41,41 @@ class JobCreateGetPost(Resource):
         if body.get('params') is None:
             body['params'] = {}
 
-        result = JobService.insert(body, history=body)
+        result = JobService.insert(body)
         tasks = TaskService.create_tasks(body, result)
         result = result.to_json()
+        HistoryWriterService.write(
+            HistoryWriterService.event(body['author'], result.get('id'), 'job_created', body)
+        )
         result['tasks'] = tasks
         return {'success': True, 'data': result}, 200
 
-    @namespace.doc('job/get', security='Bearer')
+    @namespace.doc('job/get', security='Bearer', params=QueryService.params)
     @namespace.marshal_with(jobs.list_jobs_response)
     @namespace.response(200, 'list jobs current user', jobs.list_jobs_response)
     @namespace.response(404, 'jobs not found', responses.error_response)
     @namespace.response(401, 'Unauthorized', responses.error_response)
     @jwt_required()
     def get(self):
+        author = get_jwt_identity()
+        cursor = None
+
+        if (args := QueryService.page_args()) is not None:
+            result, cursor = QueryService.page('jobs', args, author=author)
+        else:
+            result = JobService.select_jobs(**{'author': author})
 
-        result = JobService.select_jobs(**{'author': get_jwt_identity()})
         if not result:
             return {'success': False, 'message': 'jobs not found', 'data': {}}, 200
 
+        with_tasks = args is None or not args['fields'] or 'tasks' in args['fields']
         for job in result:
-            job['tasks'] = TaskService.select_tasks_edge(job.get('_id'))
+            if with_tasks:
+                job['tasks'] = TaskService.select_tasks_edge(job.get('_id'))
             if job.get('status') is None or job.get('status') == '':
                 job.update(status=TaskStatus.pending_approval.value)
 
-        return {'success': True, 'data': result}, 200
+        return {'success': True, 'data': result, 'cursor': cursor}, 200
 
 
 @namespace.route('/<string:_id>')
@@ -95,7 +110,14 @@ class Item(Resource):
         if not result:
             return {'success': False, 'message': 'job not found', 'data': {}}, 200
 
-        updated_job = JobService.update_job(id=_id, data=request.json, history=request.json)
+        updated_job = JobService.update_job(id=_id, data=request.json)
+        PipelineCacheService.bump_jobs(_id)
+        HistoryWriterService.write(
+            HistoryWriterService.event(get_jwt_identity(), _id, 'job_updated', request.json)
+        )
+
+        if 'status' in request.json:
+            CountersService.jobs_changed([(_id, result[0].get('status'), request.json['status'])])
         return {'success': True, 'data': updated_job}, 200
 
     @namespace.doc('job/delete', security='Bearer')
@@ -109,12 +131,17 @@ class Item(Resource):
         if not result:
             return {'success': False, 'message': 'job not found', 'data': {}}, 200
 
+        pipelines = PipelineCacheService.pipelines_of_jobs(_id)
+        PipelineCacheService.bump(*pipelines)
+
         tasks = TaskService.select_tasks_edge(_id)
         for task in tasks:
             JobService.delete_connection(_from=_id, _to=task['_id'])
             TaskService.delete(task['id'])
 
         deleted = JobService.delete(_id).to_json()
+        for pipeline_id in pipelines:
+            CountersService.recount(pipeline_id)
         deleted['tasks'] = tasks
         if deleted.get('status') is None or deleted.get('status') == '':
             deleted.update(status=TaskStatus.pending_approval.value)
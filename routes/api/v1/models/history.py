@@ -20,9 +20,16 @@ history_post_model = history_model.inherit('History post')
 
 
 list_history_response = response.inherit('HistoryListResponse', {
-    'data': fields.List(fields.Nested(history_get_model))
+    'data': fields.List(fields.Nested(history_get_model)),
+    'cursor': fields.String(required=False, description='cursor of the next page'),
 })
 
 a_history_response = response.inherit('TasksResponse', {
-    'data': fields.List(fields.Nested(history_get_model))
+    'data': fields.List(fields.Nested(history_get_model)),
+    'cursor': fields.String(required=False, description='cursor of the next page'),
+})
+
+history_parent_model = Model('HistoryParent', {
+    'parent': fields.String(required=True, description='parent id'),
+    'event_type': fields.String(required=False, description='event type'),
 })
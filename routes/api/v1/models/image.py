@@ -1,12 +1,19 @@
 from flask_restx import fields, Model
 from .responses import response
 
-paths = Model('PathBase', {'path': fields.String, 'format': fields.String, 'date': fields.Date})
+paths = Model('PathBase', {
+    'path': fields.String,
+    'format': fields.String,
+    'date': fields.Date,
+    'size': fields.Integer(required=False, description='longest side of a downscaled copy'),
+    'hash': fields.String(required=False, description='sha256 of the content in the image store'),
+})
 
 image_model = Model('ImgBase', {
     'name': fields.String,
     'omeroId': fields.String(required=False),
-    'paths': fields.List(fields.Nested(paths))
+    'paths': fields.List(fields.Nested(paths)),
+    'metadata': fields.Raw(required=False, description='dims, channels, dtype, physical_size, levels, bytes')
 })
 
 image_get_model = image_model.inherit('ImgGet', {
@@ -21,11 +28,30 @@ task_post_model = image_model.inherit('Task post', {
 })
 
 
+download_model = Model('ImgDownload', {
+    'id': fields.String(description='download handle'),
+    'omeroId': fields.String,
+    'format': fields.String,
+    'side': fields.Integer(required=False),
+    'state': fields.String(description='queued/waiting/running/complete/error/cancelled'),
+    'size': fields.Integer(required=False),
+    'received': fields.Integer,
+    'progress': fields.Integer(required=False),
+    'path': fields.String(required=False),
+    'error': fields.String(required=False),
+})
+
+a_download_response = response.inherit('ImgDownloadResponse', {
+    'data': fields.Nested(download_model),
+})
+
 list_images_response = response.inherit('ImageListResponse', {
-    'data': fields.List(fields.Nested(image_get_model))
+    'data': fields.List(fields.Nested(image_get_model)),
+    'cursor': fields.String(required=False, description='cursor of the next page'),
 })
 
 a_images_response = response.inherit('ImagesResponse', {
     'data': fields.List(fields.Nested(image_get_model), required=False),
-    'message': fields.String(required=False)
+    'message': fields.String(required=False),
+    'download': fields.Nested(download_model, required=False, allow_null=True),
 })
@@ -49,6 +49,7 @@ job_get_model = jobs_model.inherit('JobsGet', {
 
 list_jobs_response = response.inherit('JobsListResponse', {
     'data': fields.Nested(job_get_model, as_list=True),
+    'cursor': fields.String(required=False, description='cursor of the next page'),
 })
 
 
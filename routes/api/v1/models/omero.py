@@ -57,6 +57,24 @@ omero_thumbnail = Model('getThumbnail', {
     )
 })
 
+omero_batch_model = Model('OmeroBatchThumbnails', {
+    'ids': fields.List(
+        fields.String,
+        required=True,
+        description='Omero image ids'
+    ),
+    'size': fields.Integer(
+        required=False,
+        description='size im px',
+        default=96
+    ),
+    'metadata': fields.Boolean(
+        required=False,
+        description='add image metadata',
+        default=False
+    )
+})
+
 omero_download_model = Model('OmeroDownloadImage', {
     'login': fields.String(
         required=True,
@@ -22,6 +22,14 @@ pipeline_model = pipeline_create_model.inherit('Pipeline base1', {
     'project': fields.String(
         required=False,
         description='project id'
+    ),
+    'complete': fields.Integer(
+        required=False,
+        description='percent of complete tasks'
+    ),
+    'counters': fields.Raw(
+        required=False,
+        description='tasks and jobs by status'
     )
 })
 
@@ -54,10 +62,27 @@ a_pipeline_response = response.inherit('PipelineResponse', {
 })
 
 
+pipeline_clone_model = Model('PipelineClone', {
+    'name': fields.String(
+        description='name of the copy',
+        required=False
+    ),
+    'reuse_results': fields.Boolean(
+        description='link complete tasks to the results of the source',
+        required=False,
+        default=False
+    )
+})
+
+
 pipeline_status_model = Model('PipelineStatus', {
     'status': fields.String(
         description='pipeline name',
         required=True,
         enum=PipelineStatus._member_names_
+    ),
+    'max_running': fields.Integer(
+        description='max jobs running at the same time, 0 is unlimited',
+        required=False
     )
 })
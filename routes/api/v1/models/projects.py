@@ -28,6 +28,10 @@ project_get_model = projects_model.inherit('ProjectsGet', {
     'id': fields.String(
         required=True,
         description='User id'
+    ),
+    'counters': fields.Raw(
+        required=False,
+        description='tasks and jobs by status'
     )
 })
 
@@ -37,5 +41,6 @@ a_project_response = response.inherit('ProjectResponse', {
 })
 
 list_projects_response = response.inherit('ProjectsListResponse', {
-    'data': fields.List(fields.Nested(project_get_model))
+    'data': fields.List(fields.Nested(project_get_model)),
+    'cursor': fields.String(required=False, description='cursor of the next page'),
 })
@@ -24,7 +24,12 @@ task_post_model = tasks_model.inherit('Task post', {
 
 
 list_tasks_response = response.inherit('TaskListResponse', {
-    'data': fields.List(fields.Nested(task_get_model))
+    'data': fields.List(fields.Nested(task_get_model)),
+    'cursor': fields.String(required=False, description='cursor of the next page'),
+})
+
+batch_tasks_response = list_tasks_response.inherit('ResourceBatchResponse', {
+    'not_found': fields.List(fields.String, description='ids that were not updated')
 })
 
 a_tasks_response = response.inherit('TasksResponse', {
@@ -27,7 +27,12 @@ task_post_model = Model('TasksList', {
 
 
 list_tasks_response = response.inherit('TaskListResponse', {
-    'data': fields.Nested(task_get_model, as_list=True)
+    'data': fields.Nested(task_get_model, as_list=True),
+    'cursor': fields.String(required=False, description='cursor of the next page'),
+})
+
+batch_tasks_response = list_tasks_response.inherit('TaskBatchResponse', {
+    'not_found': fields.List(fields.String, description='ids that were not updated')
 })
 
 a_tasks_response = response.inherit('TasksResponse', {
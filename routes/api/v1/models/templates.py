@@ -19,6 +19,13 @@ templates_get_model = templates_model.inherit('Templates get', {
 
 templates_post_model = templates_model.inherit('Templates post')
 
+template_instantiate_model = Model('TemplateInstantiate', {
+    'project': fields.String(required=True, description='project id'),
+    'name': fields.String(required=False, description='pipeline name, template name by default'),
+    'omeroIds': fields.List(fields.String, required=False, description='images for every job'),
+    'fan_out': fields.Boolean(required=False, default=False, description='one pipeline per image'),
+})
+
 
 list_templates_response = response.inherit('TemplatesListResponse', {
     'data': fields.List(fields.Nested(templates_get_model))
@@ -1,37 +1,73 @@
-import spex_common.modules.omeroweb as omeroweb
 from flask_restx import Namespace, Resource
-from flask import request, abort, Response
+from flask import request, abort, Response, stream_with_context
 from .models import responses, omero
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from os import getenv
 from urllib.parse import unquote
-from spex_common.services.Utils import download_file
+import services.Downloads as DownloadsService
+import services.OmeroCache as OmeroCacheService
+import services.OmeroSessions as OmeroSessionsService
+import services.OmeroBatch as OmeroBatchService
 
 
 namespace = Namespace('Omero', description='Omero operations')
 namespace.add_model(omero.omero_download_model.name, omero.omero_download_model)
+namespace.add_model(omero.omero_batch_model.name, omero.omero_batch_model)
 namespace.add_model(omero.login_model.name, omero.login_model)
 namespace.add_model(omero.login_responce.name, omero.login_responce)
 namespace.add_model(responses.error_response.name, responses.error_response)
 
 excluded_headers = [
-    # 'content-encoding',
-    # 'content-length',
-    # 'transfer-encoding',
-    # 'connection',
+    # hop-by-hop, the server sets its own framing for the streamed body
+    'transfer-encoding',
+    'connection',
+    'keep-alive',
     'set-cookie',
     'authorization'
 ]
 
+# conditional and partial requests are answered by omero itself
+forwarded_headers = [
+    'range',
+    'if-range',
+    'if-none-match',
+    'if-modified-since',
+    'accept-encoding',
+]
+
+chunk_size = 64 * 1024
+
+
+def _stream_file(file):
+    with file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
 
 def _request(path, method='get', **kwargs):
     current_user = get_jwt_identity()
 
-    client = omeroweb.get(current_user['login'])
+    client = OmeroSessionsService.get(current_user['login'])
     path = unquote(path)
 
     if client is None:
         abort(401, 'Unauthorized')
+
+    digest = None
+    if OmeroCacheService.cacheable(path, method, request.headers):
+        digest = OmeroCacheService.key(
+            OmeroCacheService.scope(current_user['login']),
+            path,
+            request.args
+        )
+        if hit := OmeroCacheService.get(digest):
+            meta, body = hit
+            return Response(
+                _stream_file(body),
+                meta['status'],
+                meta['headers'],
+                direct_passthrough=True
+            )
+
     try:
         index = request.url.index(path) - 1
         path = request.url[index:]
@@ -40,7 +76,16 @@ def _request(path, method='get', **kwargs):
 
     method = getattr(client, method)
 
-    response = method(path, **kwargs)
+    headers = {
+        name: value
+        for (name, value) in request.headers.items()
+        if name.lower() in forwarded_headers
+    }
+    if digest is not None:
+        # a cached body serves every client, so it is stored without content encoding
+        headers['Accept-Encoding'] = 'identity'
+
+    response = method(path, headers=headers, stream=True, **kwargs)
 
     headers = [
         (name, value)
@@ -48,9 +93,35 @@ def _request(path, method='get', **kwargs):
         if name.lower() not in excluded_headers
     ]
 
-    omeroweb.update_ttl(current_user['login'])
-
-    return Response(response.content, response.status_code, headers)
+    if response.status_code in (401, 403):
+        OmeroSessionsService.invalidate(current_user['login'])
+    else:
+        OmeroSessionsService.touch(current_user['login'])
+
+    writer = None
+    if digest is not None and response.status_code == 200:
+        writer = OmeroCacheService.writer(digest, response.status_code, headers)
+
+    def generate():
+        # raw bytes as omero encoded them, so content-encoding and content-length stay true
+        complete = False
+        try:
+            for chunk in response.raw.stream(chunk_size, decode_content=False):
+                if writer is not None:
+                    writer.write(chunk)
+                yield chunk
+            complete = True
+        finally:
+            response.close()
+            if writer is not None:
+                writer.commit() if complete else writer.abort()
+
+    return Response(
+        stream_with_context(generate()),
+        response.status_code,
+        headers,
+        direct_passthrough=True
+    )
 
 
 @namespace.route('/<path:path>')
@@ -70,6 +141,46 @@ class WebGateway(Resource):
         return _request(path, 'post')
 
 
+@namespace.route('/cache/stats')
+class CacheStats(Resource):
+    @namespace.doc('omero/cache', security='Bearer')
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @jwt_required()
+    def get(self):
+        return {'success': True, 'data': OmeroCacheService.stats()}, 200
+
+
+@namespace.route('/thumbnails')
+class BatchThumbnails(Resource):
+    @namespace.doc('omero/thumbnails', security='Bearer')
+    @namespace.expect(omero.omero_batch_model)
+    @namespace.response(400, 'Wrong ids', responses.error_response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @jwt_required()
+    def post(self):
+        login = get_jwt_identity()['login']
+        client = OmeroSessionsService.get(login)
+        if client is None:
+            abort(401, 'Unauthorized')
+
+        body = request.json or {}
+        ids = body.get('ids')
+        if not isinstance(ids, list) or not ids:
+            abort(400, 'ids must be a non empty list')
+        if len(ids) > OmeroBatchService.max_ids:
+            abort(400, f'at most {OmeroBatchService.max_ids} ids')
+
+        try:
+            size = int(body.get('size') or 96)
+        except ValueError:
+            abort(400, 'size must be a number')
+
+        result = OmeroBatchService.thumbnails(client, login, ids, size, bool(body.get('metadata')))
+        OmeroSessionsService.touch(login)
+
+        return {'success': True, 'data': result}, 200
+
+
 @namespace.route('/<string:imageId>')
 class DownloadImageReturnPath(Resource):
     @namespace.doc('omero/ImageDownload', security='Bearer')
@@ -77,9 +188,8 @@ class DownloadImageReturnPath(Resource):
     @namespace.response(401, 'Unauthorized', responses.error_response)
     @jwt_required()
     def get(self, imageId, format='tif'):
-        author = get_jwt_identity()['login']
-        session = omeroweb.get(author)
-        path = getenv('OMERO_WEB') + '/webclient/render_image_download/' + str(imageId) + '/?format=' + format
-        relativePath = download_file(path, client=session, imgId=imageId)
-        if relativePath is not None:
-            return {'success': True, 'path': relativePath}, 200
+        job = DownloadsService.submit(imageId, format, get_jwt_identity())
+        if job is None:
+            abort(401, 'Unauthorized')
+
+        return {'success': True, 'download': DownloadsService.to_json(job)}, 200
@@ -1,6 +1,13 @@
 import spex_common.services.Pipeline as PipelineService
 import spex_common.services.Project as ProjectService
 import spex_common.services.Task as TaskService
+import services.PipelineGraph as PipelineGraphService
+import services.PipelineCache as PipelineCacheService
+import services.PipelineDag as PipelineDagService
+import services.Scheduler as SchedulerService
+import services.Timeline as TimelineService
+import services.Counters as CountersService
+import services.PipelineCopy as PipelineCopyService
 from spex_common.models.Status import TaskStatus
 from flask_restx import Namespace, Resource
 from flask import request
@@ -19,6 +26,7 @@ namespace.add_model(pipeline.list_pipeline_response.name, pipeline.list_pipeline
 namespace.add_model(pipeline.pipeline_get_model.name, pipeline.pipeline_get_model)
 namespace.add_model(pipeline.task_resource_image_connect_to_job.name, pipeline.task_resource_image_connect_to_job)
 namespace.add_model(pipeline.pipeline_status_model.name, pipeline.pipeline_status_model)
+namespace.add_model(pipeline.pipeline_clone_model.name, pipeline.pipeline_clone_model)
 
 
 # get pipelines list with child's
@@ -37,30 +45,7 @@ class PipelineGet(Resource):
         if not ProjectService.select_projects(_key=project_id, author=author):
             return {'success': False, 'message': f'project with id: {project_id} not found'}, 404
 
-        pipelines = PipelineService.select_pipeline(collection='pipeline', author=author, project=project_id)
-
-        lines = []
-        if not pipelines:
-            return {'success': True, 'data': {"pipelines": lines}}, 200
-
-        for item in pipelines:
-            res = []
-            jobs = PipelineService.select_pipeline(author=author, _from=item.get('_id'))
-
-            if not jobs:
-                item.pop('_from', None)
-                item.pop('_to', None)
-                item.update({'jobs': res})
-                lines.append(item)
-                continue
-
-            for job in jobs:
-                res.append(PipelineService.recursion_query(job['_to'], {}, 0, item.get('id')))
-
-            item.pop('_from', None)
-            item.pop('_to', None)
-            item.update({'jobs': res})
-            lines.append(item)
+        lines = PipelineGraphService.project_tree(project_id, author)
 
         result = {"pipelines": lines}
 
@@ -123,11 +108,34 @@ class PipelineGetList(Resource):
         if not item:
             return {'success': False, 'message': f'pipeline with id: {pipeline_id} not found'}, 404
 
-        pipelines = PipelineService.get_tree(pipeline_id=pipeline_id, author=author)
+        status = TaskStatus.from_str(request.json['status'])
+
+        if status == TaskStatus.ready.value:
+            limit = request.json.get('max_running')
+            limit = SchedulerService.max_running if limit is None else limit
+            # checked before anything is held, a bad cap would leave every task held
+            if isinstance(limit, bool) or not isinstance(limit, int) or limit <= 0:
+                return {'success': False, 'message': 'max_running must be a positive integer'}, 400
+
+            PipelineService.update(
+                collection='pipeline',
+                id=pipeline_id,
+                data={'scheduled': True, 'max_running': limit}
+            )
+            scheduled = SchedulerService.start(pipeline_id, limit)
+
+            return {'success': True, 'data': scheduled}, 200
+
+        PipelineService.update(collection='pipeline', id=pipeline_id, data={'scheduled': False})
+
+        pipelines = PipelineCacheService.get_tree(pipeline_id=pipeline_id, author=author)
         jobs = PipelineService.get_jobs(pipelines, prefix=False)
 
-        status_to_upd = {"status": TaskStatus.from_str(request.json['status'])}
+        # a manual status ends the scheduler hold
+        status_to_upd = {"status": status, "held": False}
         tasks = TaskService.update_tasks("in", data=status_to_upd, parent=jobs)
+        PipelineCacheService.bump(pipeline_id)
+        CountersService.recount(pipeline_id)
 
         return {'success': True, 'data': {"tasks": tasks}}, 200
 
@@ -144,7 +152,7 @@ class PipelineGetList(Resource):
         if not item:
             return {'success': False, 'message': f'pipeline with id: {pipeline_id} not found'}, 404
 
-        pipelines = PipelineService.get_tree(pipeline_id=pipeline_id, author=author)
+        pipelines = PipelineCacheService.get_tree(pipeline_id=pipeline_id, author=author)
 
         return {'success': True, 'data': {"pipelines": pipelines}}, 200
 
@@ -165,6 +173,7 @@ class PipelineGetList(Resource):
             return {'success': False, 'message': f'pipeline with id: {pipeline_id} not found'}, 404
 
         item = PipelineService.update(collection='pipeline', id=pipeline_id, data=body)
+        PipelineCacheService.bump(pipeline_id)
 
         return {'success': True, 'data': item.to_json()}, 200
 
@@ -185,23 +194,101 @@ class PipelineGetList(Resource):
         if not item:
             return {'success': False, 'message': f'pipeline with id: {pipeline_id} not found'}, 404
 
-        direction = PipelineService.select_pipeline(
-            collection='pipeline_direction',
-            pipeline=pipeline_id,
-            author=author
+        PipelineGraphService.remove_pipeline(pipeline_id)
+        PipelineCacheService.bump(pipeline_id)
+        CountersService.recount_project(item.get('project'))
+
+        return {'success': True}, 200
+
+
+@namespace.route('/schedule/<string:pipeline_id>')
+@namespace.param('pipeline_id', 'pipeline_id')
+class PipelineSchedule(Resource):
+    @namespace.doc('pipeline/schedule', security='Bearer', description='release the jobs whose parents are complete')
+    @namespace.response(200, 'Released jobs and state of every job', responses.response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @namespace.response(404, 'Object not found', responses.error_response)
+    @jwt_required()
+    def post(self, pipeline_id):
+        author = get_jwt_identity()
+
+        item = PipelineService.select_pipeline(collection='pipeline', _key=pipeline_id, author=author, one=True)
+        if not item:
+            return {'success': False, 'message': f'pipeline with id: {pipeline_id} not found'}, 404
+
+        scheduled = SchedulerService.schedule(pipeline_id, item.get('max_running'))
+
+        return {'success': True, 'data': scheduled}, 200
+
+
+@namespace.route('/clone/<string:pipeline_id>')
+@namespace.param('pipeline_id', 'pipeline_id')
+class PipelineClone(Resource):
+    @namespace.doc('pipeline/clone', security='Bearer', description='copy the pipeline with its jobs, tasks and links')
+    @namespace.expect(pipeline.pipeline_clone_model)
+    @namespace.response(200, 'Created pipeline', responses.response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @namespace.response(404, 'Object not found', responses.error_response)
+    @jwt_required()
+    def post(self, pipeline_id):
+        author = get_jwt_identity()
+        body = request.json or {}
+
+        item = PipelineService.select_pipeline(collection='pipeline', _key=pipeline_id, author=author, one=True)
+        if not item:
+            return {'success': False, 'message': f'pipeline with id: {pipeline_id} not found'}, 404
+
+        origin = PipelineCopyService.source(pipeline_id)
+        if origin is None:
+            return {'success': False, 'message': f'pipeline with id: {pipeline_id} not found'}, 404
+
+        plan = PipelineCopyService.clone_plan(
+            origin,
+            author,
+            name=body.get('name'),
+            reuse_results=bool(body.get('reuse_results'))
         )
-        children_to_delete = list(map(lambda row: row.get('_to'), direction)) \
-            if direction \
-            else []
+        result = PipelineCopyService.create(plan)
 
-        for child in reversed(children_to_delete):
-            PipelineService.delete(_from=child, pipeline=pipeline_id)
-            PipelineService.delete(_to=child, pipeline=pipeline_id)
+        return {'success': True, 'data': result}, 200
 
-        PipelineService.delete(collection='pipeline', _key=item.get('id'))
-        PipelineService.delete(_to=item.get('_id'))
 
-        return {'success': True}, 200
+@namespace.route('/summary/<string:pipeline_id>')
+@namespace.param('pipeline_id', 'pipeline_id')
+class PipelineSummary(Resource):
+    @namespace.doc('pipeline/summary', security='Bearer', description='tasks and jobs of the pipeline by status')
+    @namespace.response(200, 'Status counters of the pipeline', responses.response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @namespace.response(404, 'Object not found', responses.error_response)
+    @jwt_required()
+    def get(self, pipeline_id):
+        author = get_jwt_identity()
+
+        item = PipelineService.select_pipeline(collection='pipeline', _key=pipeline_id, author=author, one=True)
+        if not item:
+            return {'success': False, 'message': f'pipeline with id: {pipeline_id} not found'}, 404
+
+        return {'success': True, 'data': CountersService.summary('pipeline', pipeline_id)}, 200
+
+
+@namespace.route('/timeline/<string:pipeline_id>')
+@namespace.param('pipeline_id', 'pipeline_id')
+class PipelineTimeline(Resource):
+    @namespace.doc('pipeline/timeline', security='Bearer', description='queue wait, runtime and critical path of every job')
+    @namespace.response(200, 'Gantt timeline of the pipeline', responses.response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @namespace.response(404, 'Object not found', responses.error_response)
+    @jwt_required()
+    def get(self, pipeline_id):
+        author = get_jwt_identity()
+
+        item = PipelineService.select_pipeline(collection='pipeline', _key=pipeline_id, author=author, one=True)
+        if not item:
+            return {'success': False, 'message': f'pipeline with id: {pipeline_id} not found'}, 404
+
+        dag = PipelineDagService.index(pipeline_id)
+
+        return {'success': True, 'data': TimelineService.timeline(dag)}, 200
 
 
 @namespace.route('/link/<string:pipeline_id>/<string:pipeline_job_id>')
@@ -224,22 +311,9 @@ class PipelineDelete(Resource):
         if not item:
             return {'success': False, 'message': 'pipeline not found'}, 404
 
-        jobs = PipelineService.select_pipeline(
-            _to=f'jobs/{pipeline_job_id}',
-            pipeline=pipeline_id,
-            author=author,
-        )
-
-        res = []
-        for job in (jobs if jobs else []):
-            res.append(PipelineService.recursion_query(job['_to'], {}, 0, pipeline_id))
-
-        item.update({'jobs': res})
-        children_to_delete = PipelineService.get_jobs(item.get('jobs'))
-
-        for child in reversed(children_to_delete):
-            PipelineService.delete(_from=child, pipeline=pipeline_id)
-            PipelineService.delete(_to=child, pipeline=pipeline_id)
+        PipelineGraphService.remove_subtree(pipeline_id, pipeline_job_id)
+        PipelineCacheService.bump(pipeline_id)
+        CountersService.recount(pipeline_id)
 
         return {'success': True}, 200
 
@@ -261,50 +335,30 @@ class PipelineConnect(Resource):
         if child_id == parent_id:
             return {'success': False, 'message': 'child and parent id can not be same'}, 400
 
-        item = PipelineService.select_pipeline(
-            collection='pipeline',
-            _key=pipeline_id,
-            author=author,
-            one=True
-        )
+        context = PipelineGraphService.link_context(pipeline_id, parent_id, child_id, author)
 
+        item = context.get('pipeline')
         if item is None:
             return {'success': False, 'message': 'pipeline not found'}, 404
 
         project_id = item['project']
 
-        parent = PipelineService.select_pipeline(
-            collection='pipeline',
-            _key=parent_id,
-            author=author,
-            project=project_id,
-            one=True
-        )
+        parent = context.get('parent')
         if not parent:
-            parent = PipelineService.select_pipeline(
-                collection='jobs',
-                _key=parent_id,
-                author=author,
-                one=True
-            )
-            if not parent:
-                return {'success': False, 'message': 'parent not found'}, 404
+            return {'success': False, 'message': 'parent not found'}, 404
 
-        child = PipelineService.select_pipeline(collection='jobs', _key=child_id, author=author, one=True)
+        child = context.get('child')
         if not child:
             return {'success': False, 'message': 'child not found'}, 404
 
-        connection = PipelineService.select_pipeline(
-            collection='pipeline_direction',
-            _to=child['_id'],
-            author=author,
-            project=project_id,
-            pipeline=pipeline_id,
-            one=False
-        )
-        if connection:
+        # the current edges, not the per worker index, decide whether the link is allowed
+        dag = PipelineDagService.load(pipeline_id)
+        if dag.parents.get(child['_id']):
             return {'success': False, 'message': 'child already connected in this pipeline, remove connection first'}, 400
 
+        if dag.creates_cycle(parent['_id'], child['_id']):
+            return {'success': False, 'message': 'connection creates a cycle in this pipeline'}, 400
+
         link = {
             '_from': str(parent['_id']),
             '_to': str(child['_id']),
@@ -313,4 +367,7 @@ class PipelineConnect(Resource):
             'pipeline': str(pipeline_id)
         }
         data = PipelineService.insert(data=link, collection='pipeline_direction')
+        dag.add_edge(link['_from'], link['_to'])
+        PipelineDagService.linked(pipeline_id, dag)
+        CountersService.recount(pipeline_id)
         return {'success': True, 'data': data}, 200
@@ -1,12 +1,11 @@
 import spex_common.services.Project as ProjectService
-import spex_common.services.Pipeline as PipelineService
-import spex_common.services.Job as JobService
-import spex_common.services.Task as TaskService
+import services.PipelineCache as PipelineCacheService
+import services.Counters as CountersService
+import services.Query as QueryService
 from flask_restx import Namespace, Resource
 from flask import request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from .models import projects, responses
-from spex_common.models.Status import TaskStatus
 
 
 
@@ -37,7 +36,7 @@ class ProjectsCreateGetPost(Resource):
         result = ProjectService.insert(body)
         return {"success": True, "data": result}, 200
 
-    @namespace.doc("project/get", security="Bearer")
+    @namespace.doc("project/get", security="Bearer", params=QueryService.params)
     @namespace.marshal_with(projects.list_projects_response)
     @namespace.response(
         200, "list projects current user", projects.list_projects_response
@@ -47,12 +46,17 @@ class ProjectsCreateGetPost(Resource):
     @jwt_required()
     def get(self):
         author = get_jwt_identity()
-        result = ProjectService.select_projects(author=author)
+        cursor = None
+
+        if (args := QueryService.page_args()) is not None:
+            result, cursor = QueryService.page("projects", args, author=author)
+        else:
+            result = ProjectService.select_projects(author=author)
 
         if result is None:
             return {"success": True, "data": []}, 200
 
-        return {"success": True, "data": result}, 200
+        return {"success": True, "data": result, "cursor": cursor}, 200
 
 
 @namespace.route("/<string:id>")
@@ -121,27 +125,23 @@ class ProjectGetById(Resource):
     def get(self, id):
         author = get_jwt_identity()
 
-        result = PipelineService.select_pipeline(
-            project=id, author=author, collection="pipeline"
-        )
-        res = []
-        for pipeline in result:
-            pipelines = PipelineService.get_tree(pipeline_id=pipeline["id"])
-            jobs_list = PipelineService.get_jobs(pipelines, prefix=False)
-            task_that_we_can_wiz = ('feature_extraction', 'transformation', 'cluster', 'dml')
-            if jobs := JobService.select_jobs(condition=" in ", _key=jobs_list):
-                jobs = [
-                    job
-                    for job in jobs
-                    if job["name"] in task_that_we_can_wiz
-                    and job["status_name"] == TaskStatus.complete.name
-                ]
-                if jobs:
-                    for job in jobs:
-                        job["tasks"] = TaskService.select_tasks(parent=job["id"])
-                    pipeline["jobs"] = jobs
-                    res.append(pipeline)
+        res = PipelineCacheService.get_visualizable_jobs(id, author)
         if res is None:
             return {"success": False, "message": "project not found"}, 404
 
         return {"success": True, "data": res}, 200
+
+
+@namespace.route("/<string:id>/summary")
+class ProjectSummary(Resource):
+    @namespace.doc("project/summary", security="Bearer")
+    @namespace.response(200, "tasks and jobs of the project by status", responses.response)
+    @namespace.response(404, "projects not found", responses.error_response)
+    @namespace.response(401, "Unauthorized", responses.error_response)
+    @jwt_required()
+    def get(self, id):
+        author = get_jwt_identity()
+        if not ProjectService.select_projects(_key=id, author=author):
+            return {"success": False, "message": "project not found"}, 404
+
+        return {"success": True, "data": CountersService.summary("projects", id)}, 200
@@ -1,4 +1,6 @@
 import spex_common.services.Job as JobService
+import services.Batch as BatchService
+import services.Query as QueryService
 from flask_restx import Namespace, Resource
 from flask import request, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
@@ -14,6 +16,7 @@ namespace.add_model(responses.response.name, responses.response)
 namespace.add_model(_resource.a_tasks_response.name, _resource.a_tasks_response)
 namespace.add_model(responses.error_response.name, responses.error_response)
 namespace.add_model(_resource.list_tasks_response.name, _resource.list_tasks_response)
+namespace.add_model(_resource.batch_tasks_response.name, _resource.batch_tasks_response)
 namespace.add_model(_resource.task_get_model.name, _resource.task_get_model)
 
 
@@ -53,20 +56,18 @@ class TaskResGetPut(Resource):
 class TaskResPost(Resource):
     @namespace.doc('resource/updatemany', security='Bearer')
     @namespace.expect(_resource.task_post_model)
-    @namespace.marshal_with(_resource.list_tasks_response)
+    @namespace.marshal_with(_resource.batch_tasks_response)
     @namespace.response(404, 'resource not found', responses.error_response)
     @namespace.response(401, 'Unauthorized', responses.error_response)
     @jwt_required()
     def put(self):
         body = request.json
-        arr = []
-        for id in body['ids']:
-            data = dict(body)
-            del data['ids']
-            resource = JobService.update(id=id, data=data, collection='resource')
-            if resource is not None:
-                arr.append(resource.to_json())
-        return {'success': True, 'data': arr}, 200
+        data = dict(body)
+        del data['ids']
+
+        arr, not_found = BatchService.update_many(body['ids'], data, collection='resource')
+
+        return {'success': True, 'data': arr, 'not_found': not_found}, 200
 
     @namespace.doc('resource/insertone', security='Bearer')
     @namespace.expect(_resource.task_post_model)
@@ -80,7 +81,7 @@ class TaskResPost(Resource):
 
         return {'success': True, 'data': resource.to_json()}, 200
 
-    @namespace.doc('resource/getmany', security='Bearer')
+    @namespace.doc('resource/getmany', security='Bearer', params=QueryService.params)
     @namespace.marshal_with(_resource.list_tasks_response)
     @namespace.response(200, 'list resource current user', _resource.list_tasks_response)
     @namespace.response(404, 'resource not found', responses.error_response)
@@ -88,9 +89,14 @@ class TaskResPost(Resource):
     @jwt_required()
     def get(self):
         author = get_jwt_identity()
-        result = JobService.select_jobs(author=author, collection="resource")
+        cursor = None
+
+        if (args := QueryService.page_args()) is not None:
+            result, cursor = QueryService.page('resource', args, author=author)
+        else:
+            result = JobService.select_jobs(author=author, collection="resource")
 
         if result is None:
             abort(404, 'resource not found')
 
-        return {'success': True, 'data': result}, 200
+        return {'success': True, 'data': result, 'cursor': cursor}, 200
@@ -9,6 +9,13 @@ import io
 import spex_common.services.Task as TaskService
 import spex_common.services.Job as JobService
 import spex_common.services.Utils as Utils
+import services.Batch as BatchService
+import services.Scheduler as SchedulerService
+import services.Timeline as TimelineService
+import services.Counters as CountersService
+import services.Query as QueryService
+import services.PipelineCache as PipelineCacheService
+from spex_common.models.Status import TaskStatus
 from spex_common.modules.logging import get_logger
 from flask_restx import Namespace, Resource
 from flask import request, send_file, make_response
@@ -41,6 +48,7 @@ namespace.add_model(responses.response.name, responses.response)
 namespace.add_model(tasks.a_tasks_response.name, tasks.a_tasks_response)
 namespace.add_model(responses.error_response.name, responses.error_response)
 namespace.add_model(tasks.list_tasks_response.name, tasks.list_tasks_response)
+namespace.add_model(tasks.batch_tasks_response.name, tasks.batch_tasks_response)
 namespace.add_model(tasks.task_get_model.name, tasks.task_get_model)
 
 
@@ -70,7 +78,17 @@ class TaskGetPut(Resource):
         if _task is None:
             return {'success': False, 'message': 'task not found', 'data': {}}, 200
         body = request.json
+        previous = _task.to_json()
         _task = TaskService.update(_id, data=body)
+        TimelineService.stamp([_id], body.get('status'))
+        if previous.get('parent'):
+            PipelineCacheService.bump_jobs(previous['parent'])
+
+        if 'status' in body:
+            CountersService.tasks_changed([(previous.get('parent'), previous.get('status'), body['status'])])
+
+        if body.get('status') == TaskStatus.complete.value:
+            SchedulerService.task_completed(_task.to_json().get('parent'))
 
         return {'success': True, 'data': _task.to_json()}, 200
 
@@ -86,6 +104,8 @@ class TaskGetPut(Resource):
 
         JobService.delete_connection(_to=_task.id)
         deleted = TaskService.delete(_task.id).to_json()
+        if deleted.get('parent'):
+            PipelineCacheService.bump_jobs(deleted['parent'])
         return {'success': True, 'data': deleted}, 200
 
 
@@ -144,22 +164,23 @@ class TaskListPost(Resource):
 class TaskPost(Resource):
     @namespace.doc('tasks/update', security='Bearer')
     @namespace.expect(tasks.task_post_model)
-    @namespace.marshal_with(tasks.list_tasks_response)
+    @namespace.marshal_with(tasks.batch_tasks_response)
     @namespace.response(404, 'Task not found', responses.error_response)
     @namespace.response(401, 'Unauthorized', responses.error_response)
     @jwt_required()
     def post(self):
         body = request.json
-        arr = []
-        for _id in body['ids']:
-            data = dict(body)
-            del data['ids']
-            task = TaskService.update(_id, data=data)
-            if task is not None:
-                arr.append(task.to_json())
-        return {'success': True, 'data': arr}, 200
-
-    @namespace.doc('task/get', security='Bearer')
+        data = dict(body)
+        del data['ids']
+
+        arr, not_found = BatchService.update_many(body['ids'], data, collection='tasks', track=True)
+
+        if data.get('status') == TaskStatus.complete.value:
+            SchedulerService.task_completed(*{task.get('parent') for task in arr})
+
+        return {'success': True, 'data': arr, 'not_found': not_found}, 200
+
+    @namespace.doc('task/get', security='Bearer', params=QueryService.params)
     @namespace.marshal_with(tasks.list_tasks_response)
     @namespace.response(200, 'list tasks current user', tasks.list_tasks_response)
     @namespace.response(404, 'tasks not found', responses.error_response)
@@ -167,12 +188,17 @@ class TaskPost(Resource):
     @jwt_required()
     def get(self):
         author = get_jwt_identity()
-        result = TaskService.select_tasks(author=author)
+        cursor = None
+
+        if (args := QueryService.page_args()) is not None:
+            result, cursor = QueryService.page('tasks', args, author=author)
+        else:
+            result = TaskService.select_tasks(author=author)
 
         if result is None:
             return {'success': False, 'message': 'tasks not found', 'data': {}}, 200
 
-        return {'success': True, 'data': result}, 200
+        return {'success': True, 'data': result, 'cursor': cursor}, 200
 
 
 class NumpyEncoder(json.JSONEncoder):
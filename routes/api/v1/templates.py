@@ -1,5 +1,9 @@
 import spex_common.services.Templates as TemplateService
 import spex_common.services.Pipeline as PipelineService
+import spex_common.services.Project as ProjectService
+import services.PipelineCopy as PipelineCopyService
+import services.Query as QueryService
+import services.PipelineCache as PipelineCacheService
 from flask_restx import Namespace, Resource
 from flask import request, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
@@ -16,6 +20,7 @@ namespace.add_model(_templates.a_templates_response.name, _templates.a_templates
 namespace.add_model(responses.error_response.name, responses.error_response)
 namespace.add_model(_templates.list_templates_response.name, _templates.list_templates_response)
 namespace.add_model(_templates.templates_get_model.name, _templates.templates_get_model)
+namespace.add_model(_templates.template_instantiate_model.name, _templates.template_instantiate_model)
 
 
 # template result
@@ -51,6 +56,55 @@ class TemplateResGetPut(Resource):
         return {'success': True, 'data': template.to_json()}, 200
 
 
+@namespace.route('/<id>/instantiate')
+@namespace.param('id', 'template id')
+class TemplateInstantiate(Resource):
+    @namespace.doc('templates/instantiate', security='Bearer')
+    @namespace.expect(_templates.template_instantiate_model)
+    @namespace.response(400, 'wrong body', responses.error_response)
+    @namespace.response(404, 'template not found', responses.error_response)
+    @namespace.response(401, 'Unauthorized', responses.error_response)
+    @jwt_required()
+    def post(self, id):
+        author = get_jwt_identity()
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400, 'wrong body')
+        if not body.get('project') or not isinstance(body['project'], str):
+            abort(400, 'project is required')
+        if body.get('omeroIds') is not None and not isinstance(body['omeroIds'], list):
+            abort(400, 'omeroIds must be a list')
+
+        template = TemplateService.select(id=id)
+        if template is None:
+            abort(404, 'template not found')
+        template = template.to_json()
+
+        project_id = body['project']
+        if not ProjectService.select_projects(_key=project_id, author=author):
+            return {'success': False, 'message': f'project with id: {project_id} not found'}, 404
+
+        name = body.get('name') or template.get('name')
+        omero_ids = body.get('omeroIds')
+
+        if body.get('fan_out') and omero_ids:
+            plan = PipelineCopyService.Plan(author)
+            for omero_id in omero_ids:
+                plan.extend(PipelineCopyService.template_plan(
+                    template.get('data'),
+                    project_id,
+                    f'{name} {omero_id}',
+                    author,
+                    [omero_id]
+                ))
+        else:
+            plan = PipelineCopyService.template_plan(template.get('data'), project_id, name, author, omero_ids)
+
+        result = PipelineCopyService.create(plan)
+
+        return {'success': True, 'data': result}, 200
+
+
 @namespace.route('')
 class TemplateResPost(Resource):
     @namespace.doc('templates/insertone', security='Bearer')
@@ -70,12 +124,12 @@ class TemplateResPost(Resource):
         if not item:
             return {'success': False, 'message': f'pipeline with id: {pipeline_id} not found'}, 404
 
-        body["data"] = TemplateService.get_template_tree(pipeline_id=pipeline_id, author=author)
+        body["data"] = PipelineCacheService.get_template_tree(pipeline_id=pipeline_id, author=author)
         resp = TemplateService.insert(body)
 
         return {'success': True, 'data': resp.to_json()}, 200
 
-    @namespace.doc('template/getmany', security='Bearer')
+    @namespace.doc('template/getmany', security='Bearer', params=QueryService.params)
     # @namespace.marshal_with(_template.list_template_response)
     # @namespace.response(200, 'list template current user', _template.list_template_response)
     @namespace.response(404, 'templates not found', responses.error_response)
@@ -83,9 +137,14 @@ class TemplateResPost(Resource):
     @jwt_required()
     def get(self):
         author = get_jwt_identity()
-        result = TemplateService.select_template()
+        cursor = None
+
+        if (args := QueryService.page_args()) is not None:
+            result, cursor = QueryService.page('templates', args)
+        else:
+            result = TemplateService.select_template()
 
         if result is None:
             abort(404, 'template not found')
 
-        return {'success': True, 'data': result}, 200
+        return {'success': True, 'data': result, 'cursor': cursor}, 200
@@ -0,0 +1,53 @@
+from spex_common.modules.database import db_instance
+from spex_common.models.Status import TaskStatus
+import services.Timeline as TimelineService
+import services.Counters as CountersService
+import services.PipelineCache as PipelineCacheService
+
+
+def _with_status_name(data):
+    data = dict(data)
+    if 'status' not in data:
+        return data
+
+    try:
+        data['status_name'] = TaskStatus(data['status']).name
+    except ValueError:
+        pass
+
+    return data
+
+
+def update_many(ids, data, collection, track=False):
+    # one UPDATE ... IN statement for all ids, returns (updated, not_found)
+    keys = list(dict.fromkeys(str(_id) for _id in ids))
+    if not keys:
+        return [], []
+
+    patch = '@data'
+    if track and (expression := TimelineService.expression(data.get('status'))):
+        patch = f'MERGE(@data, {{ timeline: {expression} }})'
+
+    query = f' FOR doc IN {collection} ' \
+        ' FILTER doc._key IN @keys ' \
+        f' UPDATE doc WITH {patch} IN {collection} ' \
+        ' RETURN { doc: MERGE(NEW, { id: NEW._key }), old: OLD.status } '
+
+    result = db_instance().query(query, keys=keys, data=_with_status_name(data))
+    result = result if result else []
+    updated = [item['doc'] for item in result]
+
+    if track and 'status' in data:
+        CountersService.tasks_changed([
+            (item['doc'].get('parent'), item['old'], item['doc'].get('status'))
+            for item in result
+        ])
+
+    # cached trees carry task statuses, every task write drops the trees of its pipelines
+    if collection == 'tasks' and (parents := {doc.get('parent') for doc in updated if doc.get('parent')}):
+        PipelineCacheService.bump_jobs(*parents)
+
+    found = {doc.get('_key') for doc in updated}
+    not_found = [key for key in keys if key not in found]
+
+    return updated, not_found
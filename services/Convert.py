@@ -0,0 +1,88 @@
+import os
+import numpy as np
+from PIL import Image
+from spex_common.modules.logging import get_logger
+
+logger = get_logger('spex.backend')
+
+# masters are full resolution renders, far above the default decompression bomb guard
+Image.MAX_IMAGE_PIXELS = None
+
+extensions = {'png': 'png', 'jpeg': 'jpg', 'tif': 'tif'}
+pil_formats = {'png': 'PNG', 'jpeg': 'JPEG', 'tif': 'TIFF'}
+
+# single channel modes above 8 bits, PIL clips them when converting to RGB or L
+wide_modes = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I', 'F')
+
+
+def target(master, format, side=None):
+    stem = os.path.splitext(master)[0]
+    suffix = f'_{side}' if side else ''
+    return f'{stem}{suffix}.{extensions[format]}'
+
+
+def _to_uint8(data):
+    data = data.astype(np.float32)
+    low, high = np.min(data), np.max(data)
+    if high > low:
+        data = (data - low) * (255 / (high - low))
+    return np.clip(data, 0, 255).astype(np.uint8)
+
+
+def _open(master):
+    try:
+        image = Image.open(master)
+        image.load()
+        return image
+    except Exception as error:
+        logger.info(f'{master} is read with aicsimageio: {error}')
+
+    # multichannel or high bit depth tiffs, first plane and up to three channels as rgb
+    from aicsimageio import AICSImage
+
+    data = AICSImage(master).get_image_data('CYX', S=0, T=0, Z=0)
+    channels = [_to_uint8(plane) for plane in data[:3]]
+    if len(channels) == 1:
+        channels *= 3
+    elif len(channels) == 2:
+        channels.append(np.zeros_like(channels[0]))
+    return Image.fromarray(np.stack(channels, axis=-1), 'RGB')
+
+
+def _thumbnail(image, side):
+    if image.mode not in wide_modes:
+        image.thumbnail((side, side), Image.LANCZOS)
+        return image
+
+    # PIL resamples only I and F, so the plane is resized as float and goes back to its own dtype
+    data = np.asarray(image)
+    dtype = data.dtype.newbyteorder('=')
+    resized = Image.fromarray(data.astype(np.float32), 'F')
+    resized.thumbnail((side, side), Image.LANCZOS)
+    data = np.asarray(resized)
+    if np.issubdtype(dtype, np.integer):
+        data = np.clip(np.rint(data), np.iinfo(dtype).min, np.iinfo(dtype).max)
+    return Image.fromarray(data.astype(dtype))
+
+
+def convert(master, format, side=None):
+    path = target(master, format, side)
+    image = _open(master)
+
+    if image.mode in wide_modes and format != 'tif':
+        # stretched to the value range of the image instead of saturating
+        image = Image.fromarray(_to_uint8(np.asarray(image)), 'L')
+
+    if format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L', *wide_modes):
+        image = image.convert('RGB')
+
+    if side:
+        image = _thumbnail(image, side)
+
+    part = f'{path}.part'
+    image.save(part, pil_formats[format])
+    os.replace(part, path)
+
+    return path
@@ -0,0 +1,182 @@
+from collections import defaultdict
+from spex_common.models.Status import TaskStatus
+from spex_common.modules.database import db_instance
+from spex_common.modules.logging import get_logger
+import services.Indexes as IndexesService
+
+logger = get_logger('spex.backend')
+
+owners_query = ' FOR e IN pipeline_direction ' \
+    ' FILTER e._to IN @jobs ' \
+    ' RETURN DISTINCT { pipeline: e.pipeline, project: e.project, job: e._to } '
+
+# adds item.tasks / item.jobs ({status_name: delta}) to doc.counters in place,
+# the exclusive updates lock the collections before the documents are read
+_increment = ' LET current = doc.counters || {} ' \
+    ' LET task_counts = ZIP(ATTRIBUTES(item.tasks), ' \
+    '   (FOR name IN ATTRIBUTES(item.tasks) RETURN (current.tasks[name] || 0) + item.tasks[name])) ' \
+    ' LET job_counts = ZIP(ATTRIBUTES(item.jobs), ' \
+    '   (FOR name IN ATTRIBUTES(item.jobs) RETURN (current.jobs[name] || 0) + item.jobs[name])) ' \
+    ' LET counters = { ' \
+    '   tasks: MERGE(current.tasks || {}, task_counts), ' \
+    '   jobs: MERGE(current.jobs || {}, job_counts) ' \
+    ' } '
+
+apply_query = ' LET pipelines = ( ' \
+    '   FOR item IN @pipelines ' \
+    '   LET doc = DOCUMENT("pipeline", item.key) ' \
+    '   FILTER doc != null ' \
+    + _increment + \
+    '   LET total = SUM(VALUES(counters.tasks)) ' \
+    '   UPDATE doc WITH { ' \
+    '     counters: counters, ' \
+    '     complete: total > 0 ? FLOOR(100 * (counters.tasks[@complete] || 0) / total) : 0 ' \
+    '   } IN pipeline OPTIONS { mergeObjects: false, exclusive: true } ' \
+    '   RETURN 1 ' \
+    ' ) ' \
+    ' LET projects = ( ' \
+    '   FOR item IN @projects ' \
+    '   LET doc = DOCUMENT("projects", item.key) ' \
+    '   FILTER doc != null ' \
+    + _increment + \
+    '   UPDATE doc WITH { counters: counters } IN projects OPTIONS { mergeObjects: false, exclusive: true } ' \
+    '   RETURN 1 ' \
+    ' ) ' \
+    ' RETURN LENGTH(pipelines) + LENGTH(projects) '
+
+recount_query = ' LET doc = DOCUMENT("pipeline", @pipeline) ' \
+    ' LET linked = ( ' \
+    '   FOR e IN pipeline_direction ' \
+    '   FILTER e.pipeline == @pipeline AND IS_SAME_COLLECTION("jobs", e._to) ' \
+    '   RETURN DISTINCT DOCUMENT(e._to) ' \
+    ' ) ' \
+    ' LET task_counts = ( ' \
+    '   FOR t IN tasks ' \
+    '   FILTER t.parent IN linked[*]._key ' \
+    '   COLLECT name = t.status_name WITH COUNT INTO n ' \
+    '   RETURN [name || "none", n] ' \
+    ' ) ' \
+    ' LET job_counts = ( ' \
+    '   FOR job IN linked ' \
+    '   COLLECT name = job.status_name WITH COUNT INTO n ' \
+    '   RETURN [name || "none", n] ' \
+    ' ) ' \
+    ' LET counters = { ' \
+    '   tasks: ZIP(task_counts[*][0], task_counts[*][1]), ' \
+    '   jobs: ZIP(job_counts[*][0], job_counts[*][1]) ' \
+    ' } ' \
+    ' LET total = SUM(task_counts[*][1]) ' \
+    ' UPDATE doc WITH { ' \
+    '   counters: counters, ' \
+    '   complete: total > 0 ? FLOOR(100 * (counters.tasks[@complete] || 0) / total) : 0 ' \
+    ' } IN pipeline OPTIONS { mergeObjects: false } ' \
+    ' RETURN { project: NEW.project, counters: NEW.counters, complete: NEW.complete } '
+
+project_query = ' LET doc = DOCUMENT("projects", @project) ' \
+    ' LET counted = (FOR p IN pipeline FILTER p.project == @project RETURN p.counters || {}) ' \
+    ' LET task_names = UNIQUE(FLATTEN(FOR c IN counted RETURN ATTRIBUTES(c.tasks || {}))) ' \
+    ' LET job_names = UNIQUE(FLATTEN(FOR c IN counted RETURN ATTRIBUTES(c.jobs || {}))) ' \
+    ' LET counters = { ' \
+    '   tasks: MERGE(FOR name IN task_names RETURN { [name]: SUM(FOR c IN counted RETURN c.tasks[name] || 0) }), ' \
+    '   jobs: MERGE(FOR name IN job_names RETURN { [name]: SUM(FOR c IN counted RETURN c.jobs[name] || 0) }) ' \
+    ' } ' \
+    ' UPDATE doc WITH { counters: counters } IN projects OPTIONS { mergeObjects: false } ' \
+    ' RETURN NEW.counters '
+
+summary_query = ' LET doc = DOCUMENT(@handle) ' \
+    ' RETURN doc ? { id: doc._key, counters: doc.counters || { tasks: {}, jobs: {} }, complete: doc.complete } : null '
+
+
+def status_name(status):
+    if status is None:
+        return 'none'
+    try:
+        return TaskStatus(status).name
+    except ValueError:
+        return str(status)
+
+
+def _job_handle(job_id):
+    job_id = str(job_id)
+    return job_id if '/' in job_id else f'jobs/{job_id}'
+
+
+def _apply(task_changes=(), job_changes=()):
+    # changes are (job id, old status, new status)
+    IndexesService.ensure_pipeline()
+    deltas = defaultdict(lambda: {'tasks': defaultdict(int), 'jobs': defaultdict(int)})
+    for kind, changes in (('tasks', task_changes), ('jobs', job_changes)):
+        for job, old, new in changes:
+            if job is None or old == new:
+                continue
+            deltas[_job_handle(job)][kind][status_name(old)] -= 1
+            deltas[_job_handle(job)][kind][status_name(new)] += 1
+
+    if not deltas:
+        return
+
+    owners = db_instance().query(owners_query, jobs=list(deltas))
+
+    pipelines = defaultdict(lambda: {'tasks': defaultdict(int), 'jobs': defaultdict(int)})
+    projects = defaultdict(lambda: {'tasks': defaultdict(int), 'jobs': defaultdict(int)})
+    for owner in (owners if owners else []):
+        delta = deltas[owner['job']]
+        for target in (pipelines[owner['pipeline']], projects[owner['project']]):
+            for kind in ('tasks', 'jobs'):
+                for name, value in delta[kind].items():
+                    target[kind][name] += value
+
+    def _items(targets):
+        return [
+            {'key': key, 'tasks': dict(value['tasks']), 'jobs': dict(value['jobs'])}
+            for key, value in targets.items()
+            if key
+        ]
+
+    try:
+        db_instance().query(
+            apply_query,
+            pipelines=_items(pipelines),
+            projects=_items(projects),
+            complete=TaskStatus.complete.name
+        )
+    except Exception as error:
+        # a lost delta is repaired from the tasks themselves instead of drifting
+        logger.error(f'status counters are not updated, recounting: {error}')
+        for key in pipelines:
+            if key:
+                recount(key)
+
+
+def tasks_changed(changes):
+    _apply(task_changes=changes)
+
+
+def jobs_changed(changes):
+    _apply(job_changes=changes)
+
+
+def recount(pipeline_id):
+    IndexesService.ensure_pipeline()
+    result = db_instance().query(
+        recount_query,
+        pipeline=str(pipeline_id),
+        complete=TaskStatus.complete.name
+    )
+    if not result:
+        return None
+
+    if project := result[0].get('project'):
+        recount_project(project)
+
+    return result[0]
+
+
+def recount_project(project_id):
+    result = db_instance().query(project_query, project=str(project_id))
+    return result[0] if result else None
+
+
+def summary(collection, key):
+    result = db_instance().query(summary_query, handle=f'{collection}/{key}')
+    return result[0] if result else None
@@ -0,0 +1,432 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from os import getenv
+from uuid import uuid4
+from spex_common.modules.database import db_instance
+from spex_common.modules.logging import get_logger
+import services.OmeroSessions as OmeroSessionsService
+import services.Convert as ConvertService
+import services.ImageStore as ImageStoreService
+import services.ImageRepository as ImageRepositoryService
+import services.ImageMetadata as ImageMetadataService
+import services.Indexes as IndexesService
+
+logger = get_logger('spex.backend')
+
+workers = int(getenv('DOWNLOAD_WORKERS', 4))
+convert_workers = int(getenv('CONVERT_WORKERS', 2))
+keep = int(getenv('DOWNLOAD_KEEP', 3600))
+heartbeat = int(getenv('DOWNLOAD_HEARTBEAT', 5))
+# an active download nobody touched for this long belongs to a worker that is gone
+stale = heartbeat * 6
+chunk_size = 1024 * 1024
+
+formats = ('tif', 'png', 'jpeg')
+
+# every worker process sees the same downloads: handles are documents, and the unique
+# sparse `active` index lets only one process start a given (omeroId, format, side)
+collection = 'downloads'
+
+insert_query = f' INSERT @doc IN {collection} RETURN NEW '
+
+active_query = f' FOR d IN {collection} FILTER d.active == @active RETURN d '
+
+join_query = f' FOR d IN {collection} ' \
+    ' FILTER d._key == @key AND d.active != null ' \
+    f' UPDATE d WITH {{ copies: @author ? PUSH(d.copies, @author) : d.copies }} IN {collection} ' \
+    ' RETURN NEW '
+
+expire_query = f' FOR d IN {collection} ' \
+    ' FILTER d.active == @active AND d.updated < @before ' \
+    f' UPDATE d WITH {{ active: null, state: "error", error: "abandoned", finished: @now }} IN {collection} '
+
+report_query = f' FOR d IN {collection} ' \
+    ' FILTER d._key == @key AND d.finished == null ' \
+    f' UPDATE d WITH @patch IN {collection} ' \
+    ' RETURN NEW.cancelled == true '
+
+finish_query = f' FOR d IN {collection} ' \
+    ' FILTER d._key == @key AND d.finished == null ' \
+    f' UPDATE d WITH MERGE(@patch, {{ active: null }}) IN {collection} ' \
+    ' RETURN NEW '
+
+heartbeat_query = ' FOR key IN @keys ' \
+    f' UPDATE key WITH {{ updated: @now }} IN {collection} OPTIONS {{ ignoreErrors: true }} ' \
+    ' RETURN NEW.cancelled == true ? NEW._key : null '
+
+cancel_query = f' FOR d IN {collection} ' \
+    ' FILTER d._key == @key ' \
+    f' UPDATE d WITH {{ cancelled: d.finished == null }} IN {collection} ' \
+    ' RETURN NEW '
+
+prune_query = f' FOR d IN {collection} ' \
+    ' FILTER d.finished != null AND d.finished < @before ' \
+    f' REMOVE d IN {collection} '
+
+# the entry of the same format and size is replaced, the old ones come back for their blobs
+record_query = ' UPSERT { omeroId: @omeroId } ' \
+    ' INSERT { name: @name, omeroId: @omeroId, paths: [@entry] } ' \
+    ' UPDATE { paths: APPEND( ' \
+    '   (FOR p IN OLD.paths || [] FILTER p.format != @entry.format OR p.size != @size RETURN p), [@entry]) } ' \
+    ' IN images OPTIONS { exclusive: true } ' \
+    ' RETURN { ' \
+    '   image: MERGE(NEW, { id: NEW._key }), ' \
+    '   replaced: OLD ? (FOR p IN OLD.paths || [] FILTER p.format == @entry.format AND p.size == @size RETURN p) : [] ' \
+    ' } '
+
+_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='omero-download')
+# conversions wait for master downloads, so they never share a pool with them
+_converter = ThreadPoolExecutor(max_workers=convert_workers, thread_name_prefix='image-convert')
+_lock = threading.Lock()
+# handle -> download run by this process, kept alive by the heartbeat
+_local = {}
+_beating = None
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Download:
+    # the part of a download that lives in the process running it
+
+    def __init__(self, omero_id, format, client, side=None):
+        self.handle = uuid4().hex
+        self.omero_id = str(omero_id)
+        self.format = format
+        self.side = side
+        self.client = client
+        self.size = None
+        self.received = 0
+        self.digest = None
+        self.reported = 0
+        self.cancelled = threading.Event()
+        self.future = None
+
+    @property
+    def local(self):
+        # everything but the full resolution tif is derived from the master on disk
+        return self.format != 'tif' or self.side is not None
+
+    def report(self, state=None, force=False):
+        # progress goes to the shared document at most once per heartbeat, a cancel comes back with it
+        now = time.time()
+        if not force and state is None and now - self.reported < heartbeat:
+            return
+        self.reported = now
+
+        patch = {'size': self.size, 'received': self.received, 'updated': now}
+        if state is not None:
+            patch['state'] = state
+        cancelled = db_instance().query(report_query, key=self.handle, patch=patch)
+        if cancelled and cancelled[0]:
+            self.cancelled.set()
+
+
+def to_json(doc):
+    return {
+        'id': doc['_key'],
+        'omeroId': doc.get('omeroId'),
+        'format': doc.get('format'),
+        'side': doc.get('side'),
+        'state': doc.get('state'),
+        'size': doc.get('size'),
+        'received': doc.get('received') or 0,
+        'progress': round(100 * (doc.get('received') or 0) / doc['size']) if doc.get('size') else None,
+        'path': doc.get('path'),
+        'error': doc.get('error'),
+    }
+
+
+def _active_key(omero_id, format, side):
+    return f'{omero_id}:{format}:{side or ""}'
+
+
+def _prepare():
+    global _beating
+    IndexesService.ensure_collection(collection)
+    IndexesService.ensure(collection, ('active',), unique=True, sparse=True)
+    IndexesService.ensure(collection, ('finished',))
+
+    if _beating is not None and _beating[0] == os.getpid() and _beating[1].is_alive():
+        return
+    with _lock:
+        if _beating is not None and _beating[0] == os.getpid() and _beating[1].is_alive():
+            return
+        thread = threading.Thread(target=_heartbeat, name='download-heartbeat', daemon=True)
+        _beating = (os.getpid(), thread)
+        thread.start()
+
+
+def _heartbeat():
+    # keeps the downloads of this process from looking abandoned and picks up cancels sent to other workers
+    while True:
+        time.sleep(heartbeat)
+        with _lock:
+            keys = list(_local)
+        try:
+            if keys:
+                cancelled = db_instance().query(heartbeat_query, keys=keys, now=time.time())
+                for key in (cancelled if cancelled else []):
+                    if key:
+                        _cancel_local(key)
+            db_instance().query(prune_query, before=time.time() - keep)
+        except Exception as error:
+            logger.warning(f'download heartbeat failed: {error}')
+
+
+def _start(omero_id, format, client, side=None, author=None):
+    # raises when another process inserted the same active download first
+    item = Download(omero_id, format, client, side)
+    now = time.time()
+    doc = db_instance().query(insert_query, doc={
+        '_key': item.handle,
+        'active': _active_key(omero_id, format, side),
+        'omeroId': item.omero_id,
+        'format': format,
+        'side': side,
+        'state': 'queued',
+        'size': None,
+        'received': 0,
+        'path': None,
+        'error': None,
+        'copies': [author] if author else [],
+        'cancelled': False,
+        'created': now,
+        'updated': now,
+        'finished': None,
+    })[0]
+
+    with _lock:
+        _local[item.handle] = item
+    if item.local:
+        item.future = _converter.submit(_run, item)
+    else:
+        item.future = _executor.submit(_run, item)
+    return doc
+
+
+def _allowed(client, omero_id):
+    # the download in flight runs with the first caller's session, so a later one is checked with their own
+    try:
+        response = client.get(f'{getenv("OMERO_WEB")}/webgateway/imgData/{omero_id}/')
+    except Exception as error:
+        logger.warning(f'access to {omero_id} is not checked: {error}')
+        return False
+    return response.status_code == 200
+
+
+def _submit(omero_id, format, client, side=None, author=None):
+    # one active download per (omeroId, format, side) across every worker, later callers join it
+    active = _active_key(omero_id, format, side)
+    checked = False
+    conflicts = 0
+    while True:
+        now = time.time()
+        db_instance().query(expire_query, active=active, before=now - stale, now=now)
+
+        found = db_instance().query(active_query, active=active)
+        if not found:
+            try:
+                return _start(omero_id, format, client, side, author)
+            except Exception as error:
+                # the unique index lost a race with another process, its download is joined instead
+                conflicts += 1
+                if conflicts > 3:
+                    raise
+                logger.info(f'download of {omero_id} is started elsewhere: {error}')
+                continue
+
+        # the check talks to omero, so the lookup is repeated after it
+        if not checked:
+            if not _allowed(client, omero_id):
+                return None
+            checked = True
+            continue
+
+        if joined := db_instance().query(join_query, key=found[0]['_key'], author=author):
+            return joined[0]
+
+
+def submit(omero_id, format, author, copy=False, side=None):
+    client = OmeroSessionsService.get(author['login'])
+    if client is None:
+        return None
+
+    _prepare()
+    return _submit(str(omero_id), format, client, side, author if copy else None)
+
+
+def status(handle):
+    IndexesService.ensure_collection(collection)
+    result = db_instance().query(f' RETURN DOCUMENT("{collection}", @key) ', key=handle)
+    return result[0] if result and result[0] else None
+
+
+def _cancel_local(handle):
+    with _lock:
+        item = _local.get(handle)
+    if item is None:
+        return
+
+    item.cancelled.set()
+    if item.future is not None and item.future.cancel():
+        _finish(item, 'cancelled')
+
+
+def cancel(handle):
+    # the flag reaches the process running it through its heartbeat
+    IndexesService.ensure_collection(collection)
+    result = db_instance().query(cancel_query, key=handle)
+    if not result:
+        return None
+
+    _cancel_local(handle)
+    return status(handle)
+
+
+def _finish(item, state, error=None, path=None):
+    patch = {'state': state, 'error': error, 'finished': time.time(), 'updated': time.time()}
+    if path is not None:
+        patch['path'] = ImageStoreService.stored_path(path)
+
+    with _lock:
+        _local.pop(item.handle, None)
+
+    result = db_instance().query(finish_query, key=item.handle, patch=patch)
+    return result[0] if result else None
+
+
+def _file_name(response, item):
+    disposition = response.headers.get('Content-Disposition') or ''
+    if found := re.search(r'filename="?([^";]+)"?', disposition):
+        return os.path.basename(found.group(1))
+    return f'{item.omero_id}.{item.format}'
+
+
+def _fetch(item):
+    url = f'{getenv("OMERO_WEB")}/webclient/render_image_download/{item.omero_id}/?format={item.format}'
+    response = item.client.get(url, stream=True)
+    if response.status_code != 200:
+        raise IOError(f'omero responded {response.status_code}')
+
+    if length := response.headers.get('Content-Length'):
+        item.size = int(length)
+
+    folder = os.path.join(getenv('DATA_STORAGE'), 'originals', item.omero_id)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, _file_name(response, item))
+    part = f'{path}.{item.handle}.part'
+    digest = hashlib.sha256()
+
+    try:
+        with open(part, 'wb') as file:
+            for chunk in response.iter_content(chunk_size):
+                if item.cancelled.is_set():
+                    raise Cancelled()
+                file.write(chunk)
+                digest.update(chunk)
+                item.received += len(chunk)
+                item.report()
+        os.replace(part, path)
+        item.digest = digest.hexdigest()
+    finally:
+        response.close()
+        if os.path.exists(part):
+            os.remove(part)
+
+    return path
+
+
+def _local_master(omero_id):
+    image = ImageRepositoryService.find(omero_id, 'tif')
+    for entry in (image.get('paths') if image else []):
+        path = ImageStoreService.local_path(entry.get('path'))
+        if not entry.get('size') and os.path.exists(path or ''):
+            return path
+    return None
+
+
+def _master(item):
+    # the local tif when there is one, otherwise the master download shared with other callers
+    if path := _local_master(item.omero_id):
+        return path
+
+    master = _submit(item.omero_id, 'tif', item.client)
+    if master is None:
+        raise IOError('master download is not allowed')
+
+    item.report('waiting')
+    while (master := status(master['_key'])) is not None and master.get('finished') is None:
+        if item.cancelled.is_set():
+            raise Cancelled()
+        time.sleep(1)
+
+    if master is None or master.get('state') != 'complete':
+        raise IOError(f'master download is {master.get("state") if master else "gone"}')
+    return ImageStoreService.local_path(master['path'])
+
+
+def _convert(item):
+    master = _master(item)
+    if item.cancelled.is_set():
+        raise Cancelled()
+
+    item.report('running')
+    return ConvertService.convert(master, item.format, item.side)
+
+
+def record(omero_id, format, path, side=None, digest=None, blob=None):
+    # one exclusive upsert, so concurrent conversions of an image never drop each other's entry
+    entry = {'path': ImageStoreService.stored_path(path), 'format': format, 'date': date.today().isoformat()}
+    if side:
+        entry['size'] = side
+    if digest:
+        entry.update(hash=digest, blob=blob)
+
+    result = db_instance().query(
+        record_query,
+        omeroId=str(omero_id),
+        name=os.path.splitext(os.path.basename(path))[0],
+        entry=entry,
+        size=entry.get('size')
+    )
+    if not result:
+        return None
+
+    for item in result[0]['replaced']:
+        if item.get('blob') != blob:
+            # the replaced copy drops its reference, a file at the same path is already replaced
+            replaced = ImageStoreService.local_path(item.get('path'))
+            ImageStoreService.remove(replaced if replaced != path else None, item.get('blob'))
+
+    return result[0]['image']
+
+
+def _run(item):
+    try:
+        item.report('running', force=True)
+        if item.cancelled.is_set():
+            raise Cancelled()
+        path = _convert(item) if item.local else _fetch(item)
+        digest, blob = ImageStoreService.add(path, item.digest)
+        record(item.omero_id, item.format, path, item.side, digest, blob)
+        if not item.local:
+            ImageMetadataService.store(item.omero_id, path)
+    except Cancelled:
+        _finish(item, 'cancelled')
+        return
+    except Exception as error:
+        logger.warning(f'download of {item.omero_id} failed: {error}')
+        _finish(item, 'error', str(error))
+        return
+
+    # the copies are read when the download stops being joinable, so no late joiner is missed
+    doc = _finish(item, 'complete', path=path)
+    for author in (doc.get('copies') if doc else None) or []:
+        ImageStoreService.share(blob or path, author, os.path.basename(path))
@@ -0,0 +1,125 @@
+import json
+from flask import request, abort
+from spex_common.modules.database import db_instance
+import services.Query as QueryService
+import services.Indexes as IndexesService
+
+collection = 'history'
+
+# every filter leads an index that ends with date, so range and sort stay on the index
+indexes = (
+    ('author.id', 'date'),
+    ('parent', 'date'),
+    ('event_type', 'date'),
+)
+
+params = {
+    **QueryService.params,
+    'parent': 'parent id',
+    'event_type': 'event type',
+    'from': 'only events at or after this ISO 8601 date',
+    'to': 'only events before this ISO 8601 date',
+}
+
+filter_fields = ('parent', 'event_type')
+
+export_batch = 1000
+
+
+def encode_cursor(item):
+    return QueryService.encode_cursor(json.dumps([item.get('date'), item['_key']]))
+
+
+def decode_cursor(cursor):
+    try:
+        date, key = json.loads(cursor)
+    except (ValueError, TypeError):
+        abort(400, 'wrong cursor')
+    return date, key
+
+
+def filter_args(source=None):
+    # only known filters are taken, anything else in the request is ignored
+    source = request.args if source is None else source
+    result = {}
+    for name in (*filter_fields, 'from', 'to'):
+        value = source.get(name)
+        if value is None or value == '':
+            continue
+        if not isinstance(value, str):
+            abort(400, f'{name} must be a string')
+        if name in ('from', 'to'):
+            QueryService.iso_date(name, value)
+        result[name] = value
+    return result
+
+
+def _query(author, args, filters):
+    bind = {'author': author['id'], 'limit': args['limit']}
+    query = f' FOR doc IN {collection} ' \
+        ' FILTER doc.author.id == @author '
+
+    for name in filter_fields:
+        if name in filters:
+            query += f' FILTER doc.{name} == @{name} '
+            bind[name] = filters[name]
+
+    if 'from' in filters:
+        query += ' FILTER doc.date >= @from '
+        bind['from'] = filters['from']
+
+    if 'to' in filters:
+        query += ' FILTER doc.date < @to '
+        bind['to'] = filters['to']
+
+    if args['after'] is not None:
+        date, key = decode_cursor(args['after'])
+        query += ' FILTER doc.date > @after_date OR (doc.date == @after_date AND doc._key > @after_key) '
+        bind['after_date'] = date
+        bind['after_key'] = key
+
+    if args['since'] is not None:
+        query += ' FILTER DECODE_REV(doc._rev).date > DATE_ISO8601(@since) '
+        bind['since'] = args['since']
+
+    query += ' SORT doc.date, doc._key LIMIT @limit '
+
+    # date and _key are the cursor, so a projection always keeps them
+    if args['fields']:
+        query += ' RETURN KEEP(MERGE(doc, { id: doc._key }), @fields) '
+        bind['fields'] = list(dict.fromkeys([*args['fields'], 'date']))
+    else:
+        query += ' RETURN MERGE(doc, { id: doc._key }) '
+
+    return query, bind
+
+
+def select(author, args, filters):
+    IndexesService.ensure(collection, *indexes)
+
+    query, bind = _query(author, args, filters)
+    items = db_instance().query(query, **bind)
+    items = items if items else []
+
+    cursor = encode_cursor(items[-1]) if len(items) == args['limit'] else None
+
+    return items, cursor
+
+
+def export(author, args, filters):
+    # not a generator itself, so a bad cursor is a 400 before the stream starts
+    if args['after'] is not None:
+        decode_cursor(args['after'])
+    return _rows(author, {**args, 'limit': export_batch}, filters)
+
+
+def _rows(author, args, filters):
+    # walks the keyset pages, so only one batch is held in memory at a time
+    while True:
+        items, cursor = select(author, args, filters)
+        for item in items:
+            yield json.dumps(item, default=str) + '\n'
+
+        if cursor is None:
+            return
+        args['after'] = QueryService.decode_cursor(cursor)
@@ -0,0 +1,251 @@
+import atexit
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from os import getenv
+from spex_common.modules.database import db_instance
+from spex_common.modules.logging import get_logger
+
+logger = get_logger('spex.backend')
+
+batch_size = int(getenv('HISTORY_BATCH_SIZE', 100))
+flush_interval = float(getenv('HISTORY_FLUSH_INTERVAL', 1))
+queue_size = int(getenv('HISTORY_QUEUE_SIZE', 10000))
+spool_path = getenv(
+    'HISTORY_SPOOL',
+    os.path.join(getenv('DATA_STORAGE', '.'), 'history.spool')
+)
+
+insert_query = ' FOR item IN @items INSERT item IN history '
+
+_queue = queue.Queue(maxsize=queue_size)
+_lock = threading.Lock()
+_spool_lock = threading.Lock()
+_replay_lock = threading.Lock()
+_worker = None
+_pid = None
+
+_stats = {
+    'written': 0,
+    'spooled': 0,
+    'replayed': 0,
+    'dropped': 0,
+    'failed_flushes': 0,
+    'last_flush': None,
+}
+
+
+def event(author, parent, event_type, content):
+    return {
+        'author': author,
+        'parent': parent,
+        'event_type': event_type,
+        'content': content if isinstance(content, str) else json.dumps(content, default=str),
+        'date': datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def write(item):
+    # never blocks the request, a full queue goes straight to the spool
+    _ensure_worker()
+    try:
+        _queue.put_nowait(item)
+    except queue.Full:
+        _spool([item])
+
+
+def stats():
+    return {
+        **_stats,
+        'depth': _queue.qsize(),
+        'capacity': queue_size,
+        'spool_bytes': os.path.getsize(spool_path) if os.path.exists(spool_path) else 0,
+    }
+
+
+def _ensure_worker():
+    # one thread per process, started after uwsgi forks the workers
+    global _worker, _pid
+    if _worker is not None and _pid == os.getpid() and _worker.is_alive():
+        return
+
+    with _lock:
+        if _worker is not None and _pid == os.getpid() and _worker.is_alive():
+            return
+        _pid = os.getpid()
+        _worker = threading.Thread(target=_run, name='history-writer', daemon=True)
+        _worker.start()
+
+
+def _take(timeout):
+    items = []
+    deadline = time.monotonic() + timeout
+    while len(items) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            items.append(_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return items
+
+
+def _insert(items):
+    db_instance().query(insert_query, items=items)
+
+
+def _flush(items):
+    if not items:
+        return
+    try:
+        _insert(items)
+        _stats['written'] += len(items)
+        _stats['last_flush'] = datetime.now(timezone.utc).isoformat()
+    except Exception as error:
+        logger.warning(f'history batch of {len(items)} is spooled: {error}')
+        _stats['failed_flushes'] += 1
+        _spool(items)
+        return
+
+    # a stat per flush, the spool folder itself is only listed on start
+    if os.path.exists(spool_path):
+        _replay()
+
+
+@contextmanager
+def _spool_locked():
+    # appends and the claiming rename of every worker process are serialised on a sidecar lock file,
+    # so a claimed spool is never still open for append elsewhere
+    with _spool_lock, open(f'{spool_path}.lock', 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def _spool(items):
+    try:
+        with _spool_locked(), open(spool_path, 'a', encoding='utf-8') as file:
+            for item in items:
+                file.write(json.dumps(item, default=str) + '\n')
+        _stats['spooled'] += len(items)
+    except OSError as error:
+        logger.error(f'history events are lost: {error}')
+        _stats['dropped'] += len(items)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _own(path):
+    # the rename makes this process the only reader of the file
+    target = f'{spool_path}.{os.getpid()}.{time.time_ns()}'
+    try:
+        os.replace(path, target)
+    except OSError:
+        return None
+    return target
+
+
+def _orphans():
+    # replay files of processes that died mid replay, looked for once when the worker starts
+    directory = os.path.dirname(spool_path) or '.'
+    prefix = f'{os.path.basename(spool_path)}.'
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+
+    claimed = []
+    for name in names:
+        pid = name[len(prefix):].split('.', 1)[0] if name.startswith(prefix) else ''
+        if pid.isdigit() and (int(pid) == os.getpid() or not _alive(int(pid))):
+            if target := _own(os.path.join(directory, name)):
+                claimed.append(target)
+    return claimed
+
+
+def _claim():
+    if not os.path.exists(spool_path):
+        return []
+    with _spool_locked():
+        target = _own(spool_path)
+    return [target] if target else []
+
+
+def _read(path):
+    # a corrupt line is skipped, it must not keep the rest of the spool from replaying
+    items = []
+    with open(path, encoding='utf-8') as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                logger.warning(f'history spool line {number} of {path} is skipped: not json')
+                _stats['dropped'] += 1
+    return items
+
+
+def _replay(claimed=None):
+    if not _replay_lock.acquire(blocking=False):
+        return
+
+    try:
+        for path in (claimed or []) + _claim():
+            try:
+                items = _read(path)
+            except OSError as error:
+                logger.warning(f'history spool {path} is not read: {error}')
+                continue
+
+            # what is not inserted goes back to the spool, so no claimed file is left behind
+            for start in range(0, len(items), batch_size):
+                chunk = items[start:start + batch_size]
+                try:
+                    _insert(chunk)
+                    _stats['replayed'] += len(chunk)
+                except Exception as error:
+                    logger.warning(f'history spool is not replayed: {error}')
+                    _spool(items[start:])
+                    break
+
+            os.remove(path)
+    finally:
+        _replay_lock.release()
+
+
+def _run():
+    # spooled events of an earlier run are picked up on start
+    _replay(_orphans())
+    while True:
+        _flush(_take(flush_interval))
+
+
+def drain():
+    items = []
+    while True:
+        try:
+            items.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    for start in range(0, len(items), batch_size):
+        _flush(items[start:start + batch_size])
+
+
+atexit.register(drain)
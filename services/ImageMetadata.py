@@ -0,0 +1,116 @@
+import os
+import threading
+from spex_common.modules.database import db_instance
+from spex_common.modules.logging import get_logger
+import services.ImageRepository as ImageRepositoryService
+import services.ImageStore as ImageStoreService
+
+logger = get_logger('spex.backend')
+
+_backfill = threading.Lock()
+
+update_query = ' FOR doc IN images ' \
+    ' FILTER doc.omeroId == @omeroId ' \
+    ' UPDATE doc WITH { metadata: @metadata } IN images OPTIONS { mergeObjects: false } ' \
+    ' RETURN NEW._key '
+
+# images with a master tif but nothing extracted yet, one page after the @after key;
+# paging by key moves past images whose extraction keeps failing
+missing_query = ' FOR doc IN images ' \
+    ' FILTER doc._key > @after AND doc.metadata == null ' \
+    ' SORT doc._key ' \
+    ' LET path = FIRST(FOR path IN doc.paths || [] FILTER path.format == "tif" AND path.size == null RETURN path.path) ' \
+    ' FILTER path != null ' \
+    ' LIMIT @limit ' \
+    ' RETURN { key: doc._key, omeroId: doc.omeroId, path: path } '
+
+
+def _levels(path):
+    try:
+        import tifffile
+
+        with tifffile.TiffFile(path) as file:
+            return len(file.series[0].levels)
+    except Exception:
+        return 1
+
+
+def extract(path):
+    from aicsimageio import AICSImage
+
+    image = AICSImage(path)
+    dims = dict(zip(image.dims, image.shape))
+
+    result = {
+        'dims': dims,
+        'channels': None,
+        'dtype': str(image.dask_data.dtype),
+        'physical_size': None,
+        'levels': _levels(path),
+        'bytes': os.path.getsize(path),
+    }
+
+    try:
+        result['channels'] = [str(name) for name in image.get_channel_names()]
+    except Exception as error:
+        logger.info(f'{path} has no channel names: {error}')
+
+    try:
+        x, y, z = image.get_physical_pixel_size()
+        result['physical_size'] = {'x': x, 'y': y, 'z': z}
+    except Exception as error:
+        logger.info(f'{path} has no physical size: {error}')
+
+    return result
+
+
+def store(omero_id, path):
+    # a failed extraction never fails the download, the backfill picks it up later
+    try:
+        metadata = extract(path)
+    except Exception as error:
+        logger.warning(f'metadata of {omero_id} is not extracted: {error}')
+        return None
+
+    db_instance().query(update_query, omeroId=str(omero_id), metadata=metadata)
+    return metadata
+
+
+def get(omero_id):
+    image = ImageRepositoryService.find(omero_id)
+    return image.get('metadata') if image else None
+
+
+def missing(limit=1000, after=''):
+    result = db_instance().query(missing_query, limit=limit, after=after)
+    return [{**item, 'path': ImageStoreService.local_path(item.get('path'))} for item in (result if result else [])]
+
+
+def backfill(limit=1000):
+    # every page of images without metadata, limit is the page size
+    done = 0
+    after = ''
+    while True:
+        items = missing(limit, after)
+        for item in items:
+            if os.path.exists(item['path'] or '') and store(item['omeroId'], item['path']) is not None:
+                done += 1
+
+        if len(items) < limit:
+            return done
+        after = items[-1]['key']
+
+
+def start_backfill(limit=1000):
+    # one backfill per worker at a time, returns False when one is running
+    if not _backfill.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            logger.info(f'image metadata backfilled for {backfill(limit)} images')
+        finally:
+            _backfill.release()
+
+    threading.Thread(target=run, name='image-metadata-backfill', daemon=True).start()
+    return True
@@ -0,0 +1,58 @@
+from spex_common.modules.database import db_instance
+from spex_common.models.Image import image as im
+import services.Indexes as IndexesService
+
+collection = 'images'
+
+indexes = (
+    ('omeroId',),
+    ('metadata.dtype',),
+    ('metadata.channels[*]',),
+)
+
+# paths are narrowed to the format in the same statement, a null format keeps all of them
+find_query = ' FOR doc IN images ' \
+    ' FILTER doc.omeroId == @omeroId ' \
+    ' LET paths = @format == null ? (doc.paths || []) : ( ' \
+    '   FOR path IN doc.paths || [] FILTER path.format == @format RETURN path ' \
+    ' ) ' \
+    ' FILTER @format == null OR LENGTH(paths) > 0 ' \
+    ' LIMIT 1 ' \
+    ' RETURN MERGE(doc, { paths: paths }) '
+
+
+def find(omero_id, format=None):
+    IndexesService.ensure(collection, *indexes)
+
+    result = db_instance().query(find_query, omeroId=str(omero_id), format=format)
+    return im(result[0]).to_json() if result else None
+
+
+def search(dtype=None, channel=None, channels=None, min_x=None, min_y=None, limit=1000):
+    # only the given filters are added, so the optimizer can pick the matching index
+    IndexesService.ensure(collection, *indexes)
+
+    bind = {'limit': limit}
+    query = ' FOR doc IN images FILTER doc.metadata != null '
+
+    if dtype is not None:
+        query += ' FILTER doc.metadata.dtype == @dtype '
+        bind['dtype'] = dtype
+    if channel is not None:
+        query += ' FILTER @channel IN doc.metadata.channels[*] '
+        bind['channel'] = channel
+    if channels is not None:
+        query += ' FILTER doc.metadata.dims.C == @channels '
+        bind['channels'] = channels
+    if min_x is not None:
+        query += ' FILTER doc.metadata.dims.X >= @min_x '
+        bind['min_x'] = min_x
+    if min_y is not None:
+        query += ' FILTER doc.metadata.dims.Y >= @min_y '
+        bind['min_y'] = min_y
+
+    query += ' SORT doc._key LIMIT @limit ' \
+        ' RETURN { id: doc._key, omeroId: doc.omeroId, name: doc.name, metadata: doc.metadata } '
+
+    result = db_instance().query(query, **bind)
+    return result if result else []
@@ -0,0 +1,129 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from os import getenv
+from uuid import uuid4
+import spex_common.services.Files as FileService
+from spex_common.modules.logging import get_logger
+
+logger = get_logger('spex.backend')
+
+# every reference to a blob is a hardlink, so st_nlink - 1 is its reference count
+root = getenv('IMAGE_STORE', os.path.join(getenv('DATA_STORAGE', '.'), 'store'))
+storage = getenv('DATA_STORAGE', '.')
+
+chunk_size = 1024 * 1024
+
+_lock = threading.Lock()
+
+
+def digest_file(path):
+    value = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            value.update(chunk)
+    return value.hexdigest()
+
+
+def blob_path(digest, ext):
+    return os.path.join(root, digest[:2], f'{digest}{ext}')
+
+
+def stored_path(path):
+    # images keep their paths relative to DATA_STORAGE, like download_file returns them
+    return os.path.relpath(path, storage)
+
+
+def local_path(path):
+    # a stored path on this host, absolute ones written before stay as they are
+    if not path or (os.path.isabs(path) and os.path.exists(path)):
+        return path
+    return os.path.join(storage, path.lstrip('/\\'))
+
+
+@contextmanager
+def _locked():
+    # links and releases of every worker process are serialised on one lock file
+    os.makedirs(root, exist_ok=True)
+    with _lock, open(os.path.join(root, '.lock'), 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def link(blob, target):
+    # replaces target atomically, raises OSError where the filesystems differ
+    tmp = f'{target}.{uuid4().hex}.link'
+    os.link(blob, tmp)
+    os.replace(tmp, target)
+    return target
+
+
+def add(path, digest=None):
+    # the finished file at path becomes a reference to its blob; a file that can not
+    # be linked stays on its own and gets no blob, so a reference is always a link
+    digest = digest or digest_file(path)
+    blob = blob_path(digest, os.path.splitext(path)[1].lower())
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+
+    with _locked():
+        try:
+            if not os.path.exists(blob):
+                os.link(path, blob)
+            elif not os.path.samefile(blob, path):
+                link(blob, path)
+        except OSError as error:
+            logger.warning(f'{path} is not deduplicated: {error}')
+            return digest, None
+
+    return digest, blob
+
+
+def references(blob):
+    try:
+        return os.stat(blob).st_nlink - 1
+    except OSError:
+        return 0
+
+
+def release(blob):
+    # bytes go away only with the last reference
+    if not blob:
+        return False
+    with _locked():
+        if os.path.exists(blob) and references(blob) <= 0:
+            os.remove(blob)
+            return True
+    return False
+
+
+def remove(path, blob=None):
+    # drops one reference, and the blob when it was the last one
+    path = local_path(path)
+    if path and os.path.isfile(path):
+        os.remove(path)
+        folder = os.path.dirname(path)
+        if os.path.isdir(folder) and not os.listdir(folder):
+            os.rmdir(folder)
+    return release(blob)
+
+
+def share(source, author, name):
+    # a user copy is one more reference, not more bytes; across filesystems it is
+    # a plain copy, which owns its bytes and is no reference of the blob
+    target = os.path.join(FileService.user_folder(author=author), name)
+    with _locked():
+        try:
+            return link(source, target)
+        except OSError as error:
+            logger.warning(f'{target} is a copy, not a link: {error}')
+
+    tmp = f'{target}.{uuid4().hex}.copy'
+    shutil.copy2(source, tmp)
+    os.replace(tmp, target)
+    return target
@@ -0,0 +1,47 @@
+from spex_common.modules.database import db_instance
+from spex_common.modules.logging import get_logger
+
+logger = get_logger('spex.backend')
+
+_ensured = set()
+
+# filters the pipeline services run on every task change: tasks by job and by result
+# fingerprint, edges by pipeline
+pipeline_indexes = {
+    'tasks': (('parent',), ('result_fingerprint',)),
+    'pipeline_direction': (('pipeline',),),
+}
+_collections = set()
+
+
+def ensure_collection(collection, edge=False):
+    # collections added by the backend itself, created once per process when missing
+    if collection in _collections:
+        return
+    _collections.add(collection)
+
+    try:
+        database = db_instance().instance
+        if not database.has_collection(collection):
+            database.create_collection(collection, edge=edge)
+    except Exception as error:
+        logger.warning(f'collection {collection} is not created: {error}')
+
+
+def ensure(collection, *indexes, **options):
+    # persistent indexes are created once per process, ensuring an existing one is a no-op in arango
+    for fields in indexes:
+        name = (collection, tuple(fields), tuple(sorted(options.items())))
+        if name in _ensured:
+            continue
+        _ensured.add(name)
+
+        try:
+            db_instance().instance.collection(collection).add_persistent_index(fields=list(fields), **options)
+        except Exception as error:
+            logger.warning(f'index {collection}{list(fields)} is not created: {error}')
+
+
+def ensure_pipeline():
+    for collection, indexes in pipeline_indexes.items():
+        ensure(collection, *indexes)
@@ -0,0 +1,185 @@
+import hashlib
+import json
+from os import getenv
+from distutils.util import strtobool
+import spex_common.services.Script as ScriptService
+from spex_common.models.Status import TaskStatus
+from spex_common.modules.database import db_instance
+from spex_common.modules.logging import get_logger
+import services.Timeline as TimelineService
+import services.Counters as CountersService
+import services.PipelineCache as PipelineCacheService
+import services.PipelineDag as PipelineDagService
+import services.Indexes as IndexesService
+
+logger = get_logger('spex.backend')
+
+enabled = strtobool(getenv('MEMOIZE_RESULTS', 'True'))
+
+jobs_query = ' FOR j IN jobs FILTER j._key IN @keys RETURN j '
+
+tasks_query = ' FOR t IN tasks FILTER t.parent IN @keys RETURN t '
+
+complete_query = ' FOR t IN tasks ' \
+    ' FILTER t.parent IN @keys AND t.status == @complete AND t.result != null ' \
+    ' RETURN t '
+
+record_query = ' FOR item IN @items ' \
+    ' UPDATE item._key WITH { result_fingerprint: item.fingerprint } IN tasks '
+
+# results are only ever reused between tasks of the same author
+known_query = ' FOR t IN tasks ' \
+    ' FILTER t.result_fingerprint IN @fingerprints AND t.result != null ' \
+    ' FILTER t.author.id IN @authors ' \
+    ' COLLECT fingerprint = t.result_fingerprint, author = t.author.id INTO found ' \
+    ' RETURN { ' \
+    '   fingerprint: fingerprint, author: author, ' \
+    '   result: FIRST(found[*].t.result), task: FIRST(found[*].t._key) ' \
+    ' } '
+
+apply_query = ' FOR item IN @items ' \
+    ' UPDATE item._key WITH item.patch IN tasks ' \
+    ' RETURN [NEW.parent, OLD.status, NEW.status] '
+
+
+def canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def fingerprint(*parts):
+    return hashlib.sha256(canonical(parts).encode('utf-8')).hexdigest()
+
+
+def _key(handle):
+    return handle.split('/', 1)[-1]
+
+
+def _script_version(name, versions):
+    if name not in versions:
+        try:
+            structure = ScriptService.get_script_structure(name) or {}
+            versions[name] = structure.get('version', '')
+        except Exception as error:
+            logger.warning(error)
+            versions[name] = ''
+    return versions[name]
+
+
+def job_fingerprints(dag):
+    # merkle style: a job hash covers the hashes of every upstream job
+    order = [node for node in dag.topological_order() if node.startswith('jobs/')]
+    keys = [_key(node) for node in order]
+    if not keys:
+        return {}
+
+    jobs = db_instance().query(jobs_query, keys=keys)
+    jobs = {job['_key']: job for job in (jobs if jobs else [])}
+
+    versions = {}
+    result = {}
+    for node in order:
+        job = jobs.get(_key(node))
+        if job is None:
+            continue
+
+        upstream = sorted(
+            result[_key(parent)]
+            for parent in dag.parents.get(node, [])
+            if _key(parent) in result
+        )
+        result[job['_key']] = fingerprint(
+            job.get('name'),
+            _script_version(job.get('name'), versions),
+            job.get('params') or {},
+            sorted(str(_id) for _id in (job.get('omeroIds') or [])),
+            upstream
+        )
+
+    return result
+
+
+def task_fingerprint(job_fingerprint, task):
+    # the params the task itself ran with, not the ones of the job at release time
+    return fingerprint(job_fingerprint, task.get('omeroId'), task.get('params') or {})
+
+
+def _author(task):
+    return (task.get('author') or {}).get('id')
+
+
+def record(keys, fingerprints=None):
+    # completed tasks keep the fingerprint of what they actually ran with,
+    # computed at completion from the current jobs and the task params
+    IndexesService.ensure_pipeline()
+    keys = [key for key in keys if key]
+    if not keys:
+        return
+
+    if fingerprints is None:
+        fingerprints = {}
+        for pipeline_id in PipelineCacheService.pipelines_of_jobs(*keys):
+            fingerprints.update(job_fingerprints(PipelineDagService.load(pipeline_id)))
+
+    tasks = db_instance().query(complete_query, keys=keys, complete=TaskStatus.complete.value)
+    items = [
+        {'_key': task['_key'], 'fingerprint': value}
+        for task in (tasks if tasks else [])
+        if task['parent'] in fingerprints
+        and (value := task_fingerprint(fingerprints[task['parent']], task)) != task.get('result_fingerprint')
+    ]
+    if items:
+        db_instance().query(record_query, items=items)
+
+
+def reuse(fingerprints, keys):
+    # completes the tasks of keys that have a known result of the same author,
+    # returns the jobs that need no run at all
+    IndexesService.ensure_pipeline()
+    keys = [key for key in keys if key in fingerprints]
+    if not keys:
+        return []
+
+    tasks = db_instance().query(tasks_query, keys=keys)
+    tasks = tasks if tasks else []
+
+    task_fingerprints = {
+        task['_key']: task_fingerprint(fingerprints[task['parent']], task)
+        for task in tasks
+    }
+
+    known = {}
+    if enabled and task_fingerprints:
+        found = db_instance().query(
+            known_query,
+            fingerprints=list(set(task_fingerprints.values())),
+            authors=list({_author(task) for task in tasks if _author(task)})
+        )
+        known = {(item['fingerprint'], item['author']): item for item in (found if found else [])}
+
+    items = []
+    reused = []
+    missed = set()
+    for task in tasks:
+        value = task_fingerprints[task['_key']]
+
+        if hit := known.get((value, _author(task))):
+            patch = dict(
+                status=TaskStatus.complete.value,
+                status_name=TaskStatus.complete.name,
+                held=False,
+                result=hit['result'],
+                result_fingerprint=value,
+                reused_from=hit['task']
+            )
+            reused.append(task['_key'])
+            items.append({'_key': task['_key'], 'patch': patch})
+        else:
+            missed.add(task['parent'])
+
+    if items:
+        changed = db_instance().query(apply_query, items=items)
+        CountersService.tasks_changed(changed if changed else [])
+    TimelineService.reset(reused)
+
+    with_tasks = {task['parent'] for task in tasks}
+    return [key for key in keys if key in with_tasks and key not in missed]
@@ -0,0 +1,72 @@
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from werkzeug.datastructures import MultiDict
+import services.OmeroCache as OmeroCacheService
+
+workers = int(getenv('OMERO_BATCH_WORKERS', 8))
+max_ids = int(getenv('OMERO_BATCH_LIMIT', 500))
+
+_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='omero-batch')
+
+
+def _get(client, login, path):
+    # same keys as the gateway, both ask omero for an identity encoded body
+    cacheable = OmeroCacheService.cacheable(path, 'get', {})
+    digest = OmeroCacheService.key(OmeroCacheService.scope(login), path, MultiDict())
+
+    if cacheable and (hit := OmeroCacheService.get(digest)):
+        meta, body = hit
+        with body:
+            headers = {name.lower(): value for name, value in meta['headers']}
+            return meta['status'], headers.get('content-type'), body.read()
+
+    response = client.get(f'/{path}', headers={'Accept-Encoding': 'identity'})
+    content_type = response.headers.get('Content-Type')
+
+    if cacheable and response.status_code == 200:
+        writer = OmeroCacheService.writer(digest, 200, [
+            ('Content-Type', content_type),
+            ('Content-Length', str(len(response.content))),
+        ])
+        writer.write(response.content)
+        writer.commit()
+
+    return response.status_code, content_type, response.content
+
+
+def _item(client, login, omero_id, size, metadata):
+    result = {}
+    status, content_type, body = _get(client, login, f'webgateway/render_thumbnail/{omero_id}/{size}/')
+    if status == 200:
+        encoded = base64.b64encode(body).decode('ascii')
+        result['thumbnail'] = f'data:{content_type or "image/jpeg"};base64,{encoded}'
+    else:
+        result['error'] = f'thumbnail: omero responded {status}'
+
+    if metadata:
+        status, _, body = _get(client, login, f'webgateway/imgData/{omero_id}/')
+        if status == 200:
+            result['metadata'] = json.loads(body)
+        else:
+            result['error'] = f'metadata: omero responded {status}'
+
+    return result
+
+
+def thumbnails(client, login, ids, size=96, metadata=False):
+    ids = list(dict.fromkeys(str(_id) for _id in ids))
+    futures = {
+        omero_id: _executor.submit(_item, client, login, omero_id, size, metadata)
+        for omero_id in ids
+    }
+
+    result = {}
+    for omero_id, future in futures.items():
+        try:
+            result[omero_id] = future.result()
+        except Exception as error:
+            result[omero_id] = {'error': str(error)}
+
+    return result
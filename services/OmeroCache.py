@@ -0,0 +1,77 @@
+import os
+import re
+from os import getenv
+from distutils.util import strtobool
+from modules.disk_cache import DiskCache
+
+enabled = strtobool(getenv('OMERO_CACHE', 'True'))
+
+# render endpoints are immutable for an image id and its render settings in the query
+allow = [
+    re.compile(pattern) for pattern in getenv(
+        'OMERO_CACHE_ALLOW',
+        r'webgateway/render_thumbnail/,webgateway/render_birds_eye_view/,'
+        r'webgateway/render_image/,webgateway/render_image_region/,'
+        r'webgateway/imgData/,webclient/render_thumbnail/'
+    ).split(',') if pattern
+]
+
+deny = [
+    re.compile(pattern) for pattern in getenv(
+        'OMERO_CACHE_DENY',
+        r'download,login,logout'
+    ).split(',') if pattern
+]
+
+# cache busting parameters of the viewers
+ignored_args = ('_', 'callback')
+
+_cache = None
+
+
+def cache():
+    global _cache
+    if _cache is None:
+        _cache = DiskCache(
+            getenv('OMERO_CACHE_FOLDER', os.path.join(getenv('DATA_STORAGE', '.'), 'omero_cache')),
+            int(getenv('OMERO_CACHE_BYTES', 2 * 1024 ** 3)),
+            int(getenv('OMERO_CACHE_MAX_ENTRY', 64 * 1024 ** 2))
+        )
+    return _cache
+
+
+def cacheable(path, method, headers):
+    if not enabled or method != 'get' or 'range' in headers:
+        return False
+    if any(pattern.search(path) for pattern in deny):
+        return False
+    return any(pattern.search(path) for pattern in allow)
+
+
+def scope(login):
+    # the web client does not expose the active group of a session, so entries are
+    # never shared between logins whose permissions may differ
+    return f'user:{login}'
+
+
+def key(scope_name, path, args):
+    # cached bodies are always identity encoded, so the gateway and the batch endpoint share entries
+    query = sorted(
+        (name, value)
+        for name, values in args.lists()
+        if name not in ignored_args
+        for value in values
+    )
+    return DiskCache.digest(scope_name, path.strip('/'), query)
+
+
+def get(digest):
+    return cache().get(digest)
+
+
+def writer(digest, status, headers):
+    return cache().writer(digest, {'status': status, 'headers': headers})
+
+
+def stats():
+    return cache().stats() if enabled else {'enabled': False}
@@ -0,0 +1,47 @@
+import time
+from os import getenv
+from threading import Lock
+import spex_common.modules.omeroweb as omeroweb
+
+# a cached client is trusted this long before the session store is asked again
+client_ttl = int(getenv('OMERO_CLIENT_TTL', 60))
+# the session ttl in redis is extended at most once per interval and login
+refresh_interval = int(getenv('OMERO_TTL_REFRESH', 60))
+
+_lock = Lock()
+_clients = {}
+_refreshed = {}
+
+
+def get(login):
+    # keeps the client, and its keep-alive connection pool, between requests of a worker
+    now = time.monotonic()
+    cached = _clients.get(login)
+    if cached is not None and now - cached[1] < client_ttl:
+        return cached[0]
+
+    client = omeroweb.get(login)
+    with _lock:
+        if client is None:
+            _clients.pop(login, None)
+            _refreshed.pop(login, None)
+        else:
+            _clients[login] = (client, now)
+    return client
+
+
+def touch(login):
+    now = time.monotonic()
+    with _lock:
+        if now - _refreshed.get(login, float('-inf')) < refresh_interval:
+            return
+        _refreshed[login] = now
+
+    omeroweb.update_ttl(login)
+
+
+def invalidate(login):
+    # the session is gone on the omero side, the next call revalidates it
+    with _lock:
+        _clients.pop(login, None)
+        _refreshed.pop(login, None)
@@ -0,0 +1,76 @@
+from os import getenv
+import spex_common.services.Pipeline as PipelineService
+import spex_common.services.Templates as TemplateService
+from spex_common.modules.database import db_instance
+from modules.cache import VersionedCache
+import services.PipelineGraph as PipelineGraphService
+
+trees = VersionedCache(
+    'pipeline_tree',
+    size=int(getenv('PIPELINE_CACHE_SIZE', 256)),
+    ttl=int(getenv('PIPELINE_CACHE_TTL', 30))
+)
+
+projects = VersionedCache(
+    'project_jobs',
+    size=int(getenv('PIPELINE_CACHE_SIZE', 256)),
+    ttl=int(getenv('PROJECT_LIST_CACHE_TTL', 10))
+)
+
+
+def _author_key(author):
+    return author.get('id', '') if author else ''
+
+
+def _job_handle(job_id):
+    job_id = str(job_id)
+    return job_id if '/' in job_id else f'jobs/{job_id}'
+
+
+def version(pipeline_id):
+    return trees.version(str(pipeline_id))
+
+
+def bump(*pipeline_ids):
+    trees.bump(*pipeline_ids)
+
+
+def pipelines_of_jobs(*job_ids):
+    query = ' FOR e IN pipeline_direction ' \
+        ' FILTER e._to IN @jobs OR e._from IN @jobs ' \
+        ' RETURN DISTINCT e.pipeline '
+
+    result = db_instance().query(query, jobs=[_job_handle(_id) for _id in job_ids])
+    return [item for item in (result if result else []) if item]
+
+
+def bump_jobs(*job_ids):
+    bump(*pipelines_of_jobs(*job_ids))
+
+
+def get_tree(pipeline_id, author=None):
+    kwargs = {'pipeline_id': pipeline_id}
+    if author is not None:
+        kwargs['author'] = author
+
+    return trees.get(
+        pipeline_id,
+        f'tree:{_author_key(author)}',
+        lambda: PipelineService.get_tree(**kwargs)
+    )
+
+
+def get_template_tree(pipeline_id, author):
+    return trees.get(
+        pipeline_id,
+        f'template:{_author_key(author)}',
+        lambda: TemplateService.get_template_tree(pipeline_id=pipeline_id, author=author)
+    )
+
+
+def get_visualizable_jobs(project_id, author):
+    return projects.get(
+        project_id,
+        _author_key(author),
+        lambda: PipelineGraphService.visualizable_jobs(project_id, author)
+    )
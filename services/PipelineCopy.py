@@ -0,0 +1,221 @@
+from uuid import uuid4
+from spex_common.models.Status import TaskStatus
+from spex_common.modules.database import db_instance
+import services.Counters as CountersService
+import services.Indexes as IndexesService
+
+create_query = ' LET pipelines = (FOR item IN @pipelines INSERT item IN pipeline RETURN MERGE(NEW, { id: NEW._key })) ' \
+    ' LET created_jobs = (FOR item IN @jobs INSERT item IN jobs RETURN NEW._key) ' \
+    ' LET created_tasks = (FOR item IN @tasks INSERT item IN tasks RETURN NEW._key) ' \
+    ' LET links = (FOR item IN @links INSERT item IN pipeline_direction RETURN NEW._key) ' \
+    ' RETURN { ' \
+    '   pipelines: pipelines, ' \
+    '   jobs: LENGTH(created_jobs), ' \
+    '   tasks: LENGTH(created_tasks), ' \
+    '   links: LENGTH(links) ' \
+    ' } '
+
+source_query = ' LET p = DOCUMENT("pipeline", @pipeline) ' \
+    ' LET edges = ( ' \
+    '   FOR e IN pipeline_direction ' \
+    '   FILTER e.pipeline == @pipeline AND NOT STARTS_WITH(e._from, "projects/") ' \
+    '   RETURN [e._from, e._to] ' \
+    ' ) ' \
+    ' LET job_keys = UNIQUE( ' \
+    '   FOR e IN edges FILTER STARTS_WITH(e[1], "jobs/") RETURN PARSE_IDENTIFIER(e[1]).key ' \
+    ' ) ' \
+    ' RETURN { ' \
+    '   pipeline: p, ' \
+    '   edges: edges, ' \
+    '   jobs: (FOR j IN jobs FILTER j._key IN job_keys RETURN j), ' \
+    '   tasks: (FOR t IN tasks FILTER t.parent IN job_keys RETURN t) ' \
+    ' } '
+
+job_fields = ('name', 'content', 'params', 'omeroIds')
+
+# the timeline stays behind, a clone keeps the results but not the run times of the source
+result_fields = ('result', 'impath', 'fingerprint', 'result_fingerprint')
+
+
+def new_key():
+    return uuid4().hex
+
+
+class Plan:
+    # documents with pre-generated keys, so edges can point at them before they exist
+
+    def __init__(self, author):
+        self.author = author
+        self.pipelines = []
+        self.jobs = []
+        self.tasks = []
+        self.links = []
+
+    def pipeline(self, project_id, name, **extra):
+        key = new_key()
+        self.pipelines.append({
+            '_key': key,
+            'name': name,
+            'author': self.author,
+            'complete': 0,
+            'project': str(project_id),
+            **extra,
+        })
+        self.link(f'projects/{project_id}', f'pipeline/{key}', project_id, key)
+        return key
+
+    def job(self, source, omero_ids=None, status=TaskStatus.pending_approval, **extra):
+        key = new_key()
+        data = {name: source.get(name) for name in job_fields if source.get(name) is not None}
+        data.setdefault('params', {})
+        if omero_ids is not None:
+            data['omeroIds'] = list(omero_ids)
+
+        self.jobs.append({
+            **data,
+            **extra,
+            '_key': key,
+            'author': self.author,
+            'status': status.value,
+            'status_name': status.name,
+        })
+        return key, data
+
+    def task(self, job_key, job, omero_id, status=TaskStatus.pending_approval, **extra):
+        key = new_key()
+        self.tasks.append({
+            'name': job.get('name'),
+            'content': job.get('content'),
+            'params': job.get('params', {}),
+            'omeroId': str(omero_id) if omero_id is not None else None,
+            **extra,
+            '_key': key,
+            'parent': job_key,
+            'author': self.author,
+            'status': status.value,
+            'status_name': status.name,
+        })
+        # jobs list and delete their tasks through the job -> task edge,
+        # it carries no pipeline so the pipeline graph never sees it
+        self.links.append({
+            '_from': f'jobs/{job_key}',
+            '_to': f'tasks/{key}',
+            'author': self.author,
+        })
+        return key
+
+    def link(self, _from, _to, project_id, pipeline_key):
+        self.links.append({
+            '_from': _from,
+            '_to': _to,
+            'author': self.author,
+            'project': str(project_id),
+            'pipeline': pipeline_key,
+        })
+
+    def extend(self, other):
+        self.pipelines.extend(other.pipelines)
+        self.jobs.extend(other.jobs)
+        self.tasks.extend(other.tasks)
+        self.links.extend(other.links)
+
+
+def _node_id(node):
+    return node.get('_id') or node.get('id') or node.get('_key')
+
+
+def template_plan(nodes, project_id, name, author, omero_ids=None):
+    # nodes is a stored template tree: jobs with their children under `jobs`
+    plan = Plan(author)
+    pipeline_key = plan.pipeline(project_id, name)
+
+    created = {}
+    stack = [(f'pipeline/{pipeline_key}', node) for node in reversed(nodes or [])]
+    while stack:
+        parent, node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+
+        node_id = _node_id(node) or id(node)
+        if node_id not in created:
+            key, job = plan.job(node, omero_ids)
+            for omero_id in job.get('omeroIds') or []:
+                plan.task(key, job, omero_id)
+            created[node_id] = key
+            stack.extend((f'jobs/{key}', child) for child in reversed(node.get('jobs') or []))
+
+        plan.link(parent, f'jobs/{created[node_id]}', project_id, pipeline_key)
+
+    return plan
+
+
+def source(pipeline_id):
+    IndexesService.ensure_pipeline()
+    result = db_instance().query(source_query, pipeline=str(pipeline_id))
+    return result[0] if result and result[0].get('pipeline') else None
+
+
+def clone_plan(origin, author, name=None, reuse_results=False):
+    # origin is what source() returns
+    item = origin['pipeline']
+    project_id = item['project']
+
+    plan = Plan(author)
+    pipeline_key = plan.pipeline(project_id, name or f'{item.get("name")} copy', cloned_from=item['_key'])
+
+    tasks_of = {}
+    for task in origin['tasks']:
+        tasks_of.setdefault(task['parent'], []).append(task)
+
+    created = {f'pipeline/{item["_key"]}': f'pipeline/{pipeline_key}'}
+    for job in origin['jobs']:
+        tasks = tasks_of.get(job['_key'], [])
+        done = {
+            task['_key'] for task in tasks
+            if task.get('status') == TaskStatus.complete.value and task.get('result') is not None
+        }
+        reuse = reuse_results and tasks and len(done) == len(tasks)
+
+        key, data = plan.job(
+            job,
+            status=TaskStatus.complete if reuse else TaskStatus.pending_approval,
+            cloned_from=job['_key']
+        )
+        created[job['_id']] = f'jobs/{key}'
+
+        for task in tasks:
+            if reuse_results and task['_key'] in done:
+                extra = {name: task[name] for name in result_fields if name in task}
+                plan.task(
+                    key,
+                    data,
+                    task.get('omeroId'),
+                    status=TaskStatus.complete,
+                    reused_from=task['_key'],
+                    **extra
+                )
+            else:
+                plan.task(key, data, task.get('omeroId'))
+
+    for _from, _to in origin['edges']:
+        if _from in created and _to in created:
+            plan.link(created[_from], created[_to], project_id, pipeline_key)
+
+    return plan
+
+
+def create(plan):
+    # one AQL statement, so either every document is written or none
+    result = db_instance().query(
+        create_query,
+        pipelines=plan.pipelines,
+        jobs=plan.jobs,
+        tasks=plan.tasks,
+        links=plan.links
+    )
+    result = result[0] if result else None
+
+    for item in plan.pipelines:
+        CountersService.recount(item['_key'])
+
+    return result
@@ -0,0 +1,127 @@
+import time
+from collections import defaultdict, deque
+from os import getenv
+from threading import Lock
+from spex_common.modules.database import db_instance
+import services.PipelineCache as PipelineCache
+import services.Indexes as IndexesService
+
+# the shared version catches every bump, the ttl bounds how long an index lives anyway
+ttl = int(getenv('PIPELINE_DAG_TTL', 5))
+
+edges_query = ' FOR e IN pipeline_direction ' \
+    ' FILTER e.pipeline == @pipeline ' \
+    ' FILTER NOT STARTS_WITH(e._from, "projects/") ' \
+    ' RETURN [e._from, e._to] '
+
+
+class CycleError(ValueError):
+    pass
+
+
+class PipelineDag:
+    # nodes are document handles: pipeline/<key> and jobs/<key>
+
+    def __init__(self, edges=()):
+        self.children = defaultdict(list)
+        self.parents = defaultdict(list)
+        self._descendants = {}
+        for parent, child in edges:
+            self.children[parent].append(child)
+            self.parents[child].append(parent)
+
+    @property
+    def nodes(self):
+        return set(self.children) | set(self.parents)
+
+    def _closure(self, node, adjacency):
+        seen = set()
+        stack = list(adjacency.get(node, []))
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            stack.extend(adjacency.get(current, []))
+        return seen
+
+    def descendants(self, node):
+        if node not in self._descendants:
+            self._descendants[node] = self._closure(node, self.children)
+        return self._descendants[node]
+
+    def ancestors(self, node):
+        return self._closure(node, self.parents)
+
+    def reachable(self, source, target):
+        return target in self.descendants(source)
+
+    def creates_cycle(self, parent, child):
+        return parent == child or self.reachable(child, parent)
+
+    def add_edge(self, parent, child):
+        if self.creates_cycle(parent, child):
+            raise CycleError(f'{parent} -> {child} creates a cycle')
+
+        self.children[parent].append(child)
+        self.parents[child].append(parent)
+
+        # only the new parent and its ancestors can reach more nodes now
+        for node in self.ancestors(parent) | {parent}:
+            self._descendants.pop(node, None)
+
+    def topological_order(self):
+        degree = {node: len(set(self.parents.get(node, []))) for node in self.nodes}
+        ready = deque(node for node, count in degree.items() if count == 0)
+        order = []
+
+        while ready:
+            node = ready.popleft()
+            order.append(node)
+            for child in set(self.children.get(node, [])):
+                degree[child] -= 1
+                if degree[child] == 0:
+                    ready.append(child)
+
+        if len(order) != len(degree):
+            raise CycleError('pipeline contains a cycle')
+
+        return order
+
+
+_lock = Lock()
+_indexes = {}
+
+
+def load(pipeline_id):
+    # straight from the database, for decisions that must not see a stale index
+    IndexesService.ensure_pipeline()
+    edges = db_instance().query(edges_query, pipeline=str(pipeline_id))
+    return PipelineDag(edges if edges else [])
+
+
+def index(pipeline_id):
+    pipeline_id = str(pipeline_id)
+    version = PipelineCache.version(pipeline_id)
+
+    with _lock:
+        cached = _indexes.get(pipeline_id)
+    if cached and cached[0] == version and time.monotonic() - cached[1] < ttl:
+        return cached[2]
+
+    dag = load(pipeline_id)
+    with _lock:
+        _indexes[pipeline_id] = (version, time.monotonic(), dag)
+
+    return dag
+
+
+def linked(pipeline_id, dag):
+    # dag is the writer's fresh copy with the new edge, it replaces the index under the bumped version
+    pipeline_id = str(pipeline_id)
+    PipelineCache.bump(pipeline_id)
+
+    with _lock:
+        _indexes[pipeline_id] = (PipelineCache.version(pipeline_id), time.monotonic(), dag)
+
+    return dag
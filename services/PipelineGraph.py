@@ -0,0 +1,197 @@
+from os import getenv
+from spex_common.modules.database import db_instance
+from spex_common.models.Status import TaskStatus
+import services.Indexes as IndexesService
+
+max_depth = int(getenv('PIPELINE_MAX_DEPTH', 100))
+
+# the edges of a pipeline are selected directly, a traversal would enumerate every path
+project_tree_query = ' FOR p IN pipeline ' \
+    ' FILTER p.project == @project AND p.author == @author ' \
+    ' LET links = ( ' \
+    '   FOR e IN pipeline_direction ' \
+    '   FILTER e.pipeline == p._key AND e.author == @author ' \
+    '   FILTER IS_SAME_COLLECTION("jobs", e._to) ' \
+    '   LET v = DOCUMENT(e._to) ' \
+    '   FILTER v != null ' \
+    '   RETURN DISTINCT { _from: e._from, job: MERGE(v, { id: v._key }) } ' \
+    ' ) ' \
+    ' RETURN { pipeline: MERGE(p, { id: p._key }), links: links } '
+
+link_context_query = ' LET item = FIRST( ' \
+    '   FOR p IN pipeline FILTER p._key == @pipeline AND p.author == @author RETURN p ' \
+    ' ) ' \
+    ' LET parent = FIRST(APPEND( ' \
+    '   (FOR p IN pipeline ' \
+    '     FILTER p._key == @parent AND p.author == @author AND p.project == item.project ' \
+    '     RETURN p), ' \
+    '   (FOR j IN jobs FILTER j._key == @parent AND j.author == @author RETURN j) ' \
+    ' )) ' \
+    ' LET child = FIRST( ' \
+    '   FOR j IN jobs FILTER j._key == @child AND j.author == @author RETURN j ' \
+    ' ) ' \
+    ' RETURN { pipeline: item, parent: parent, child: child } '
+
+visualizable = ('feature_extraction', 'transformation', 'cluster', 'dml')
+
+visualizable_jobs_query = ' FOR p IN pipeline ' \
+    ' FILTER p.project == @project AND p.author == @author ' \
+    ' LET found = ( ' \
+    '   FOR e IN pipeline_direction ' \
+    '   FILTER e.pipeline == p._key AND IS_SAME_COLLECTION("jobs", e._to) ' \
+    '   LET v = DOCUMENT(e._to) ' \
+    '   FILTER v.name IN @names AND v.status_name == @status_name ' \
+    '   RETURN DISTINCT v ' \
+    ' ) ' \
+    ' FILTER LENGTH(found) > 0 ' \
+    ' LET jobs = ( ' \
+    '   FOR job IN found ' \
+    '   LET tasks = (FOR t IN tasks FILTER t.parent == job._key RETURN MERGE(t, { id: t._key })) ' \
+    '   RETURN MERGE(job, { id: job._key, tasks: tasks }) ' \
+    ' ) ' \
+    ' RETURN MERGE(p, { id: p._key, jobs: jobs }) '
+
+
+def _node(doc):
+    node = dict(doc)
+    node.pop('_from', None)
+    node.pop('_to', None)
+    node['jobs'] = []
+    return node
+
+
+def assemble(root_id, links, depth=max_depth):
+    # a job reached by several parents is shared, edges back into the current path are dropped,
+    # so a cycle never makes the result circular
+    nodes = {}
+    children = {}
+    for link in links:
+        job = link['job']
+        if job['_id'] not in nodes:
+            nodes[job['_id']] = _node(job)
+        children.setdefault(link['_from'], []).append(job['_id'])
+
+    visiting, done = set(), set()
+
+    def visit(node_id, level):
+        visiting.add(node_id)
+        for child_id in children.get(node_id, []):
+            if child_id in visiting or level >= depth:
+                continue
+            nodes[node_id]['jobs'].append(nodes[child_id])
+            if child_id not in done:
+                visit(child_id, level + 1)
+        visiting.discard(node_id)
+        done.add(node_id)
+
+    roots = []
+    for child_id in dict.fromkeys(children.get(root_id, [])):
+        roots.append(nodes[child_id])
+        if child_id not in done:
+            visit(child_id, 1)
+
+    return roots
+
+
+def project_tree(project_id, author, depth=max_depth):
+    IndexesService.ensure_pipeline()
+    rows = db_instance().query(
+        project_tree_query,
+        project=str(project_id),
+        author=author
+    )
+
+    lines = []
+    for row in (rows if rows else []):
+        item = row['pipeline']
+        item.pop('_from', None)
+        item.pop('_to', None)
+        item['jobs'] = assemble(item['_id'], row['links'], depth)
+        lines.append(item)
+
+    return lines
+
+
+remove_pipeline_query = ' LET edges = ( ' \
+    '   FOR e IN pipeline_direction ' \
+    '   FILTER e.pipeline == @pipeline OR e._to == CONCAT("pipeline/", @pipeline) ' \
+    '   REMOVE e IN pipeline_direction ' \
+    '   RETURN OLD._id ' \
+    ' ) ' \
+    ' LET removed = ( ' \
+    '   FOR p IN pipeline ' \
+    '   FILTER p._key == @pipeline ' \
+    '   REMOVE p IN pipeline ' \
+    '   RETURN OLD ' \
+    ' ) ' \
+    ' RETURN { edges: edges, pipeline: FIRST(removed) } '
+
+edges_query = ' FOR e IN pipeline_direction ' \
+    ' FILTER e.pipeline == @pipeline ' \
+    ' RETURN [e._from, e._to] '
+
+remove_subtree_query = ' FOR e IN pipeline_direction ' \
+    ' FILTER e.pipeline == @pipeline ' \
+    ' FILTER e._from IN @nodes OR e._to IN @nodes ' \
+    ' REMOVE e IN pipeline_direction ' \
+    ' RETURN OLD._id '
+
+
+def remove_pipeline(pipeline_id):
+    # the pipeline, its project link and every edge of it in one statement
+    result = db_instance().query(remove_pipeline_query, pipeline=str(pipeline_id))
+    return result[0] if result else None
+
+
+def remove_subtree(pipeline_id, job_id, depth=max_depth):
+    # unlinks the job and everything below it inside this pipeline,
+    # reachability is walked here once per node instead of per path in a traversal
+    IndexesService.ensure_pipeline()
+    edges = db_instance().query(edges_query, pipeline=str(pipeline_id))
+    children = {}
+    for _from, _to in (edges if edges else []):
+        children.setdefault(_from, []).append(_to)
+
+    start = f'jobs/{job_id}'
+    nodes = {start: 0}
+    queue = [start]
+    while queue:
+        node = queue.pop(0)
+        if nodes[node] >= depth:
+            continue
+        for child in children.get(node, []):
+            if child not in nodes:
+                nodes[child] = nodes[node] + 1
+                queue.append(child)
+
+    result = db_instance().query(
+        remove_subtree_query,
+        pipeline=str(pipeline_id),
+        nodes=list(nodes)
+    )
+    return result if result else []
+
+
+def link_context(pipeline_id, parent_id, child_id, author):
+    # pipeline, parent (pipeline or job) and child job in one round trip
+    result = db_instance().query(
+        link_context_query,
+        pipeline=str(pipeline_id),
+        parent=str(parent_id),
+        child=str(child_id),
+        author=author
+    )
+    return result[0] if result else {}
+
+
+def visualizable_jobs(project_id, author):
+    # project pipelines with their complete visualizable jobs and tasks
+    IndexesService.ensure_pipeline()
+    result = db_instance().query(
+        visualizable_jobs_query,
+        project=str(project_id),
+        author=author,
+        names=list(visualizable),
+        status_name=TaskStatus.complete.name
+    )
+    return result if result else []
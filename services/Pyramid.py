@@ -0,0 +1,240 @@
+import fcntl
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from uuid import uuid4
+import numpy as np
+from PIL import Image
+from spex_common.modules.logging import get_logger
+import services.ImageRepository as ImageRepositoryService
+import services.ImageStore as ImageStoreService
+
+logger = get_logger('spex.backend')
+
+root = getenv('PYRAMID_STORE', os.path.join(getenv('DATA_STORAGE', '.'), 'pyramids'))
+tile_size = int(getenv('PYRAMID_TILE', 256))
+workers = int(getenv('PYRAMID_WORKERS', 1))
+max_region = int(getenv('PYRAMID_MAX_REGION', 4096 * 4096))
+retry = int(getenv('PYRAMID_RETRY', 300))
+
+# channels beyond the first three need an explicit c= selection
+colors = ((1, 0, 0), (0, 1, 0), (0, 0, 1))
+
+_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-pyramid')
+_lock = threading.Lock()
+_building = {}
+# folder -> (time, error) of the last failed build, retried once `retry` seconds passed
+_failed = {}
+
+
+def _master(omero_id):
+    image = ImageRepositoryService.find(omero_id, 'tif')
+    for entry in (image.get('paths') if image else []):
+        if not entry.get('size') and os.path.exists(ImageStoreService.local_path(entry.get('path')) or ''):
+            return entry
+    return None
+
+
+def _folder(entry, z):
+    # keyed by content, so every image with the same bytes shares one pyramid
+    name = entry.get('hash') or os.path.splitext(os.path.basename(entry['path']))[0]
+    return os.path.join(root, name, str(z))
+
+
+def _downscale(plane):
+    # mean of 2x2 blocks, odd edges are padded by repeating the last row or column;
+    # the level keeps the source dtype, so no level is held as a wider copy
+    height, width = plane.shape
+    if height % 2 or width % 2:
+        plane = np.pad(plane, ((0, height % 2), (0, width % 2)), mode='edge')
+    mean = plane.reshape(plane.shape[0] // 2, 2, plane.shape[1] // 2, 2).mean(axis=(1, 3), dtype=np.float32)
+    if np.issubdtype(plane.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(plane.dtype)
+
+
+def _save(path, **arrays):
+    # written aside and renamed, a reader in another process never sees half a tile
+    part = f'{path}.{uuid4().hex}.part'
+    try:
+        with open(part, 'wb') as file:
+            np.savez_compressed(file, **arrays)
+        os.replace(part, path)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+
+
+def build(path, folder, z=0):
+    from aicsimageio import AICSImage
+
+    data = AICSImage(path).get_image_data('CYX', S=0, T=0, Z=z)
+    return write([plane for plane in data], folder)
+
+
+def write(channels, folder):
+    # channels are 2d planes of one size and dtype
+    dtype = channels[0].dtype
+
+    manifest = {
+        'dtype': str(dtype),
+        'channels': len(channels),
+        'tile': tile_size,
+        'range': [[float(np.min(plane)), float(np.max(plane))] for plane in channels],
+        'levels': [],
+    }
+
+    # levels are written from full resolution down to one tile
+    level = 0
+    while True:
+        height, width = channels[0].shape
+        tiles_x, tiles_y = -(-width // tile_size), -(-height // tile_size)
+        manifest['levels'].append({'width': width, 'height': height, 'tiles_x': tiles_x, 'tiles_y': tiles_y})
+
+        for c, plane in enumerate(channels):
+            target = os.path.join(folder, str(level), str(c))
+            os.makedirs(target, exist_ok=True)
+            for ty in range(tiles_y):
+                for tx in range(tiles_x):
+                    tile = plane[ty * tile_size:(ty + 1) * tile_size, tx * tile_size:(tx + 1) * tile_size]
+                    _save(os.path.join(target, f'{ty}_{tx}.npz'), tile=tile.astype(dtype))
+
+        if max(height, width) <= tile_size:
+            break
+        channels = [_downscale(plane) for plane in channels]
+        level += 1
+
+    # the manifest is written last, its presence marks a complete pyramid
+    part = os.path.join(folder, f'manifest.json.{uuid4().hex}.part')
+    with open(part, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+    os.replace(part, os.path.join(folder, 'manifest.json'))
+
+    return manifest
+
+
+def _build(path, folder, z):
+    # a failed build is reported instead of retried on every tile, until `retry` seconds passed
+    try:
+        _build_once(path, folder, z)
+    except Exception as error:
+        logger.warning(f'pyramid of {path} is not built: {error}')
+        with _lock:
+            _failed[folder] = (time.monotonic(), str(error))
+            _building.pop(folder, None)
+        return
+
+    with _lock:
+        _failed.pop(folder, None)
+        _building.pop(folder, None)
+
+
+def _build_once(path, folder, z):
+    # the lock file keeps the other worker processes from building the same pyramid,
+    # the one that does not get it leaves the folder to the one that did
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, '.build.lock'), 'a') as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            if not os.path.exists(os.path.join(folder, 'manifest.json')):
+                build(path, folder, z)
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def manifest(omero_id, z=0):
+    # returns (state, folder, manifest), a missing pyramid is queued for building
+    entry = _master(omero_id)
+    if entry is None:
+        return 'missing', None, None
+
+    folder = _folder(entry, z)
+    path = os.path.join(folder, 'manifest.json')
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            return 'ready', folder, json.load(file)
+
+    with _lock:
+        failed = _failed.get(folder)
+        if failed is not None and time.monotonic() - failed[0] < retry:
+            return 'error', folder, None
+
+        if folder not in _building:
+            _failed.pop(folder, None)
+            _building[folder] = _executor.submit(_build, ImageStoreService.local_path(entry['path']), folder, z)
+
+    return 'building', folder, None
+
+
+def _level(info, zoom):
+    # zoom 0 is the coarsest level, one tile for the whole image
+    levels = info['levels']
+    if zoom < 0 or zoom >= len(levels):
+        return None
+    return len(levels) - 1 - zoom
+
+
+def region(folder, info, zoom, x, y, width, height, channels):
+    # stitches the tiles under a pixel rectangle of one zoom level, per channel
+    index = _level(info, zoom)
+    if index is None:
+        return None
+    level = info['levels'][index]
+    size = info['tile']
+
+    # a window starting left of or above the image is clipped, not shifted
+    if x < 0:
+        width, x = width + x, 0
+    if y < 0:
+        height, y = height + y, 0
+    width, height = min(width, level['width'] - x), min(height, level['height'] - y)
+    if width <= 0 or height <= 0:
+        return None
+
+    result = []
+    for c in channels:
+        plane = np.zeros((height, width), dtype=info['dtype'])
+        for ty in range(y // size, (y + height - 1) // size + 1):
+            for tx in range(x // size, (x + width - 1) // size + 1):
+                with np.load(os.path.join(folder, str(index), str(c), f'{ty}_{tx}.npz')) as file:
+                    tile = file['tile']
+                top, left = ty * size, tx * size
+                y0, x0 = max(y, top), max(x, left)
+                y1 = min(y + height, top + tile.shape[0])
+                x1 = min(x + width, left + tile.shape[1])
+                plane[y0 - y:y1 - y, x0 - x:x1 - x] = tile[y0 - top:y1 - top, x0 - left:x1 - left]
+        result.append(plane)
+
+    return result
+
+
+def tile(folder, info, zoom, tx, ty, channels):
+    size = info['tile']
+    return region(folder, info, zoom, tx * size, ty * size, size, size, channels)
+
+
+def render(planes, windows):
+    # channel min/max windows, then each channel adds its color, png bytes
+    height, width = planes[0].shape
+    if len(planes) == 1:
+        low, high = windows[0]
+        scaled = np.clip((planes[0].astype(np.float32) - low) / max(high - low, 1e-9), 0, 1)
+        image = Image.fromarray((scaled * 255).astype(np.uint8), 'L')
+    else:
+        rgb = np.zeros((height, width, 3), dtype=np.float32)
+        for plane, (low, high), color in zip(planes, windows, colors):
+            scaled = np.clip((plane.astype(np.float32) - low) / max(high - low, 1e-9), 0, 1)
+            rgb += scaled[..., None] * np.array(color, dtype=np.float32)
+        image = Image.fromarray((np.clip(rgb, 0, 1) * 255).astype(np.uint8), 'RGB')
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    buffer.seek(0)
+    return buffer
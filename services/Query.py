@@ -0,0 +1,94 @@
+import base64
+from datetime import datetime
+from os import getenv
+from flask import request, abort
+from spex_common.modules.database import db_instance
+
+max_limit = int(getenv('LIST_PAGE_LIMIT', 1000))
+
+params = {
+    'limit': 'page size',
+    'cursor': 'cursor of the next page from the previous response',
+    'fields': 'comma separated fields to return',
+    'since': 'only documents changed after this ISO 8601 date',
+}
+
+_always = ('id', '_key', '_id')
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(str(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        return base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    except ValueError:
+        abort(400, 'wrong cursor')
+
+
+def iso_date(name, value):
+    # rejected here, an unparsable date would silently match nothing in aql
+    try:
+        datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        abort(400, f'{name} must be an ISO 8601 date')
+    return value
+
+
+def page_args(always=False):
+    # None keeps the unpaged behaviour when no paging argument was sent
+    args = request.args
+    if not always and not any(name in args for name in params):
+        return None
+
+    limit = args.get('limit', max_limit)
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400, 'limit must be a number')
+    if limit <= 0:
+        abort(400, 'limit must be positive')
+
+    fields = [name.strip() for name in args.get('fields', '').split(',') if name.strip()]
+
+    return {
+        'limit': min(limit, max_limit),
+        'after': decode_cursor(args['cursor']) if args.get('cursor') else None,
+        'fields': list(dict.fromkeys([*_always, *fields])) if fields else None,
+        'since': iso_date('since', args['since']) if args.get('since') else None,
+    }
+
+
+def page(collection, args, **filters):
+    # keyset page over _key, filters are equality matches on top level attributes
+    bind = {'limit': args['limit']}
+    query = f' FOR doc IN {collection} '
+
+    for index, (name, value) in enumerate(filters.items()):
+        query += f' FILTER doc.@attr{index} == @value{index} '
+        bind[f'attr{index}'] = name
+        bind[f'value{index}'] = value
+
+    if args['after'] is not None:
+        query += ' FILTER doc._key > @after '
+        bind['after'] = args['after']
+
+    if args['since'] is not None:
+        query += ' FILTER DECODE_REV(doc._rev).date > DATE_ISO8601(@since) '
+        bind['since'] = args['since']
+
+    query += ' SORT doc._key LIMIT @limit '
+
+    if args['fields']:
+        query += ' RETURN KEEP(MERGE(doc, { id: doc._key }), @fields) '
+        bind['fields'] = args['fields']
+    else:
+        query += ' RETURN MERGE(doc, { id: doc._key }) '
+
+    items = db_instance().query(query, **bind)
+    items = items if items else []
+
+    cursor = encode_cursor(items[-1]['_key']) if len(items) == args['limit'] else None
+
+    return items, cursor
@@ -0,0 +1,213 @@
+from os import getenv
+from spex_common.models.Status import TaskStatus
+from spex_common.modules.database import db_instance
+import services.PipelineDag as PipelineDagService
+import services.PipelineCache as PipelineCacheService
+import services.Memo as MemoService
+import services.Timeline as TimelineService
+import services.Counters as CountersService
+import services.Indexes as IndexesService
+
+max_running = int(getenv('SCHEDULER_MAX_RUNNING', 0))
+
+# held tasks wait for the scheduler: pending_approval with held set, so they stay apart
+# from tasks that wait for a user approval and are never picked by a worker
+job_states_query = ' FOR t IN tasks ' \
+    ' FILTER t.parent IN @jobs ' \
+    ' COLLECT job = t.parent ' \
+    ' AGGREGATE total = LENGTH(1), ' \
+    '   done = SUM(t.status == @complete ? 1 : 0), ' \
+    '   held = SUM(t.held == true ? 1 : 0), ' \
+    '   approval = SUM(t.status == @pending AND t.held != true ? 1 : 0), ' \
+    '   failed = SUM(t.status == @failed ? 1 : 0) ' \
+    ' RETURN { job: job, total: total, done: done, held: held, approval: approval, failed: failed } '
+
+# only idle tasks are held, tasks a worker already runs are left alone
+hold_query = ' FOR doc IN tasks ' \
+    ' FILTER doc.parent IN @jobs AND doc.status IN @idle ' \
+    ' UPDATE doc WITH { status: @pending, status_name: @pending_name, held: true } IN tasks ' \
+    '   OPTIONS { exclusive: true } ' \
+    ' RETURN { task: NEW, old: OLD.status } '
+
+# the cap is checked against the running jobs counted under the same exclusive lock,
+# so concurrent calls can not both pass it
+release_query = ' LET running = LENGTH( ' \
+    '   FOR t IN tasks ' \
+    '   FILTER t.parent IN @jobs AND t.held != true AND t.status NOT IN @settled ' \
+    '   RETURN DISTINCT t.parent ' \
+    ' ) ' \
+    ' LET allowed = @limit > 0 ? SLICE(@release, 0, MAX([@limit - running, 0])) : @release ' \
+    ' FOR doc IN tasks ' \
+    ' FILTER doc.parent IN allowed AND doc.held == true ' \
+    ' UPDATE doc WITH {{ status: @ready, status_name: @ready_name, held: false, timeline: {timeline} }} IN tasks ' \
+    '   OPTIONS {{ exclusive: true }} ' \
+    ' RETURN {{ task: MERGE(NEW, {{ id: NEW._key }}), old: OLD.status }} '
+
+idle = (TaskStatus.pending_approval, TaskStatus.ready, TaskStatus.complete, TaskStatus.error)
+
+settled = (TaskStatus.pending_approval, TaskStatus.complete, TaskStatus.error)
+
+scheduled_query = ' FOR p IN pipeline ' \
+    ' FILTER p._key IN @pipelines AND p.scheduled == true ' \
+    ' RETURN p '
+
+
+def _key(handle):
+    return handle.split('/', 1)[-1]
+
+
+def _jobs(dag):
+    return [node for node in dag.topological_order() if node.startswith('jobs/')]
+
+
+def job_states(keys):
+    IndexesService.ensure_pipeline()
+    rows = db_instance().query(
+        job_states_query,
+        jobs=list(keys),
+        complete=TaskStatus.complete.value,
+        pending=TaskStatus.pending_approval.value,
+        failed=TaskStatus.error.value
+    )
+    rows = {row['job']: row for row in (rows if rows else [])}
+
+    states = {}
+    for key in keys:
+        row = rows.get(key)
+        if row is None or row['done'] == row['total']:
+            states[key] = 'complete'
+        elif row['failed']:
+            states[key] = 'failed'
+        elif row['held'] and row['held'] == row['total'] - row['done']:
+            states[key] = 'waiting'
+        elif row['approval'] == row['total'] - row['done']:
+            states[key] = 'approval'
+        else:
+            states[key] = 'running'
+
+    return states
+
+
+def _changed(result):
+    CountersService.tasks_changed([
+        (item['task'].get('parent'), item['old'], item['task'].get('status'))
+        for item in result
+    ])
+    return [item['task'] for item in result]
+
+
+def hold(keys):
+    IndexesService.ensure_pipeline()
+    if not keys:
+        return []
+
+    result = db_instance().query(
+        hold_query,
+        jobs=list(keys),
+        idle=[item.value for item in idle],
+        pending=TaskStatus.pending_approval.value,
+        pending_name=TaskStatus.pending_approval.name
+    )
+    return _changed(result if result else [])
+
+
+def release(keys, to_release, limit):
+    IndexesService.ensure_pipeline()
+    if not to_release:
+        return []
+
+    timeline = TimelineService.expression(TaskStatus.ready.value)
+    result = db_instance().query(
+        release_query.format(timeline=timeline),
+        jobs=list(keys),
+        release=list(to_release),
+        limit=limit,
+        settled=[item.value for item in settled],
+        ready=TaskStatus.ready.value,
+        ready_name=TaskStatus.ready.name
+    )
+    return _changed(result if result else [])
+
+
+def frontier(dag, states):
+    # waiting jobs whose job parents are all complete, in topological order
+    ready = []
+    for node in _jobs(dag):
+        if states.get(_key(node)) != 'waiting':
+            continue
+
+        parents = [parent for parent in dag.parents.get(node, []) if parent.startswith('jobs/')]
+        if all(states.get(_key(parent)) == 'complete' for parent in parents):
+            ready.append(_key(node))
+
+    return ready
+
+
+def schedule(pipeline_id, limit=None):
+    limit = max_running if limit is None else int(limit)
+
+    # the release decision reads the edges fresh, not the per worker index
+    dag = PipelineDagService.load(pipeline_id)
+    keys = [_key(node) for node in _jobs(dag)]
+    states = job_states(keys)
+
+    fingerprints = MemoService.job_fingerprints(dag)
+
+    # jobs with a stored result for their fingerprint complete at once and open the next level
+    reused = []
+    while True:
+        to_release = frontier(dag, states)
+        completed = MemoService.reuse(fingerprints, to_release)
+        if not completed:
+            break
+        reused.extend(completed)
+        for key in completed:
+            states[key] = 'complete'
+
+    tasks = release(keys, to_release, limit)
+    if tasks or reused:
+        PipelineCacheService.bump(pipeline_id)
+
+    to_release = list(dict.fromkeys(task['parent'] for task in tasks))
+    for key in to_release:
+        states[key] = 'running'
+
+    return {
+        'released': to_release,
+        'reused': reused,
+        'tasks': tasks,
+        'states': states,
+    }
+
+
+def start(pipeline_id, limit=None):
+    # holds every job, then releases only the ready frontier,
+    # unchanged jobs get their stored results back instead of a run
+    dag = PipelineDagService.load(pipeline_id)
+    keys = [_key(node) for node in _jobs(dag)]
+
+    if hold(keys):
+        PipelineCacheService.bump(pipeline_id)
+
+    return schedule(pipeline_id, limit)
+
+
+def task_completed(*job_keys):
+    # advance every scheduled pipeline that contains one of these jobs
+    job_keys = [key for key in job_keys if key]
+    if not job_keys:
+        return []
+
+    # the result fingerprint is taken now, from the params the tasks ran with
+    MemoService.record(job_keys)
+
+    pipelines = PipelineCacheService.pipelines_of_jobs(*job_keys)
+    if not pipelines:
+        return []
+
+    scheduled = db_instance().query(scheduled_query, pipelines=pipelines)
+
+    return [
+        schedule(item['_key'], item.get('max_running'))
+        for item in (scheduled if scheduled else [])
+    ]
@@ -0,0 +1,173 @@
+from datetime import datetime
+from spex_common.models.Status import TaskStatus
+from spex_common.modules.database import db_instance
+import services.Indexes as IndexesService
+
+tasks_query = ' FOR t IN tasks ' \
+    ' FILTER t.parent IN @keys ' \
+    ' RETURN { id: t._key, parent: t.parent, status: t.status, timeline: t.timeline } '
+
+stamp_query = ' FOR doc IN tasks ' \
+    ' FILTER doc._key IN @keys ' \
+    ' UPDATE doc WITH {{ timeline: {timeline} }} IN tasks '
+
+# aql object merged into the timeline of `doc` for each kind of status change
+_expressions = {
+    'queued': '{ queued_at: DATE_ISO8601(DATE_NOW()), started_at: null, finished_at: null }',
+    'started': '{ started_at: doc.timeline.started_at || DATE_ISO8601(DATE_NOW()) }',
+    'finished': '{ started_at: doc.timeline.started_at || DATE_ISO8601(DATE_NOW()), '
+                'finished_at: DATE_ISO8601(DATE_NOW()) }',
+    # a stored result handed back without a run takes no time at all
+    'reused': '{ queued_at: DATE_ISO8601(DATE_NOW()), started_at: DATE_ISO8601(DATE_NOW()), '
+              'finished_at: DATE_ISO8601(DATE_NOW()) }',
+}
+
+# status name to kind of change, statuses not listed record nothing
+_kinds = {
+    'ready': 'queued',
+    'started': 'started',
+    'in_work': 'started',
+    'complete': 'finished',
+    'error': 'finished',
+}
+
+
+def kind(status):
+    if status is None:
+        return None
+
+    try:
+        status = TaskStatus(status)
+    except ValueError:
+        return None
+
+    return _kinds.get(status.name)
+
+
+def expression(status):
+    # aql expression for `doc.timeline` after a change to status, None if nothing to record
+    if (name := kind(status)) is None:
+        return None
+    return f'MERGE(doc.timeline || {{}}, {_expressions[name]})'
+
+
+def stamp(keys, status):
+    if not keys or (timeline := expression(status)) is None:
+        return
+    db_instance().query(stamp_query.format(timeline=timeline), keys=list(keys))
+
+
+def reset(keys):
+    # a fresh timeline for tasks completed from a stored result
+    if not keys:
+        return
+    db_instance().query(stamp_query.format(timeline=_expressions['reused']), keys=list(keys))
+
+
+def _time(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def _seconds(start, end):
+    if start is None or end is None:
+        return None
+    return round(end - start, 3)
+
+
+def job_spans(keys):
+    IndexesService.ensure_pipeline()
+    tasks = db_instance().query(tasks_query, keys=list(keys))
+
+    spans = {key: {'queued': [], 'started': [], 'finished': [], 'tasks': 0} for key in keys}
+    for task in (tasks if tasks else []):
+        span = spans.get(task['parent'])
+        if span is None:
+            continue
+        timeline = task.get('timeline') or {}
+        span['tasks'] += 1
+        for name in ('queued', 'started', 'finished'):
+            if (value := _time(timeline.get(f'{name}_at'))) is not None:
+                span[name].append(value)
+
+    result = {}
+    for key, span in spans.items():
+        queued = min(span['queued'], default=None)
+        started = min(span['started'], default=None)
+        # a job is finished only when every task is
+        finished = max(span['finished']) if span['tasks'] and len(span['finished']) == span['tasks'] else None
+
+        result[key] = {
+            'queued': queued,
+            'started': started,
+            'finished': finished,
+            'queue_wait': _seconds(queued, started),
+            'runtime': _seconds(started, finished),
+        }
+
+    return result
+
+
+def critical_path(dag, spans):
+    # longest chain of queue wait + runtime through the dag
+    best = {}
+    previous = {}
+    for node in dag.topological_order():
+        if not node.startswith('jobs/'):
+            continue
+
+        key = node.split('/', 1)[-1]
+        span = spans.get(key, {})
+        weight = (span.get('queue_wait') or 0) + (span.get('runtime') or 0)
+
+        best[key] = weight
+        for parent in dag.parents.get(node, []):
+            parent_key = parent.split('/', 1)[-1]
+            if parent_key in best and best[parent_key] + weight > best[key]:
+                best[key] = best[parent_key] + weight
+                previous[key] = parent_key
+
+    if not best:
+        return {'jobs': [], 'seconds': 0}
+
+    key = max(best, key=best.get)
+    total = best[key]
+    path = [key]
+    while key in previous:
+        key = previous[key]
+        path.append(key)
+
+    return {'jobs': list(reversed(path)), 'seconds': round(total, 3)}
+
+
+def timeline(dag):
+    keys = [node.split('/', 1)[-1] for node in dag.topological_order() if node.startswith('jobs/')]
+    spans = job_spans(keys)
+
+    origin = min((span['queued'] for span in spans.values() if span['queued'] is not None), default=None)
+
+    gantt = []
+    for key in keys:
+        span = spans[key]
+        gantt.append({
+            'job': key,
+            'parents': [
+                parent.split('/', 1)[-1]
+                for parent in dag.parents.get(f'jobs/{key}', [])
+                if parent.startswith('jobs/')
+            ],
+            'queued': _seconds(origin, span['queued']),
+            'started': _seconds(origin, span['started']),
+            'finished': _seconds(origin, span['finished']),
+            'queue_wait': span['queue_wait'],
+            'runtime': span['runtime'],
+        })
+
+    finished = [span['finished'] for span in spans.values() if span['finished'] is not None]
+
+    return {
+        'jobs': gantt,
+        'wall_clock': _seconds(origin, max(finished)) if finished and origin is not None else None,
+        'critical_path': critical_path(dag, spans),
+    }
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+    from PIL import Image
+    import services.Convert as Convert
+except ImportError as error:
+    raise unittest.SkipTest(f'convert dependencies are missing: {error}')
+
+
+class ConvertTest(unittest.TestCase):
+    # a 16 bit master with values far above 255
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.master = os.path.join(self.folder, 'master.tif')
+        self.data = (np.arange(32 * 16, dtype=np.uint16).reshape(16, 32) * 100)
+        Image.fromarray(self.data).save(self.master, 'TIFF')
+
+    def test_tif_with_size_keeps_depth(self):
+        path = Convert.convert(self.master, 'tif', side=8)
+        with Image.open(path) as image:
+            self.assertEqual(image.mode, 'I;16')
+            self.assertEqual(image.size, (8, 4))
+            data = np.asarray(image)
+        self.assertGreater(int(data.max()), 255)
+        self.assertLessEqual(int(data.max()), int(self.data.max()))
+
+    def test_png_with_size_is_stretched(self):
+        path = Convert.convert(self.master, 'png', side=8)
+        with Image.open(path) as image:
+            self.assertEqual(image.mode, 'L')
+            self.assertEqual(image.size, (8, 4))
+            data = np.asarray(image)
+        # stretched to the value range, not clipped to white
+        self.assertLess(int(data.min()), 64)
+        self.assertGreater(int(data.max()), 192)
+
+    def test_jpeg(self):
+        path = Convert.convert(self.master, 'jpeg')
+        with Image.open(path) as image:
+            self.assertEqual(image.mode, 'L')
+            self.assertEqual(image.size, (32, 16))
+
+
+if __name__ == '__main__':
+    unittest.main()
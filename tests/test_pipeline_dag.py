@@ -0,0 +1,66 @@
+import unittest
+
+try:
+    from services.PipelineDag import PipelineDag, CycleError
+except ImportError as error:
+    raise unittest.SkipTest(f'pipeline dependencies are missing: {error}')
+
+
+def diamond():
+    # pipeline -> a -> b, c -> d
+    return PipelineDag([
+        ('pipeline/p', 'jobs/a'),
+        ('jobs/a', 'jobs/b'),
+        ('jobs/a', 'jobs/c'),
+        ('jobs/b', 'jobs/d'),
+        ('jobs/c', 'jobs/d'),
+    ])
+
+
+class PipelineDagTest(unittest.TestCase):
+
+    def test_topological_order(self):
+        order = diamond().topological_order()
+        self.assertEqual(order[0], 'pipeline/p')
+        self.assertEqual(order[1], 'jobs/a')
+        self.assertEqual(set(order[2:4]), {'jobs/b', 'jobs/c'})
+        self.assertEqual(order[4], 'jobs/d')
+
+    def test_topological_order_with_duplicate_edges(self):
+        dag = PipelineDag([('jobs/a', 'jobs/b'), ('jobs/a', 'jobs/b')])
+        self.assertEqual(dag.topological_order(), ['jobs/a', 'jobs/b'])
+
+    def test_topological_order_of_a_cycle(self):
+        dag = PipelineDag([('jobs/a', 'jobs/b'), ('jobs/b', 'jobs/a')])
+        with self.assertRaises(CycleError):
+            dag.topological_order()
+
+    def test_ancestors_and_descendants(self):
+        dag = diamond()
+        self.assertEqual(dag.descendants('jobs/a'), {'jobs/b', 'jobs/c', 'jobs/d'})
+        self.assertEqual(dag.ancestors('jobs/d'), {'jobs/a', 'jobs/b', 'jobs/c', 'pipeline/p'})
+        self.assertEqual(dag.descendants('jobs/d'), set())
+        self.assertEqual(dag.ancestors('jobs/missing'), set())
+
+    def test_creates_cycle(self):
+        dag = diamond()
+        self.assertTrue(dag.creates_cycle('jobs/d', 'jobs/a'))
+        self.assertTrue(dag.creates_cycle('jobs/b', 'jobs/b'))
+        self.assertFalse(dag.creates_cycle('jobs/b', 'jobs/c'))
+
+    def test_add_edge_refreshes_descendants(self):
+        dag = diamond()
+        self.assertEqual(dag.descendants('pipeline/p'), {'jobs/a', 'jobs/b', 'jobs/c', 'jobs/d'})
+        dag.add_edge('jobs/d', 'jobs/e')
+        self.assertIn('jobs/e', dag.descendants('pipeline/p'))
+        self.assertIn('jobs/e', dag.descendants('jobs/b'))
+
+    def test_add_edge_rejects_a_cycle(self):
+        dag = diamond()
+        with self.assertRaises(CycleError):
+            dag.add_edge('jobs/d', 'jobs/a')
+        self.assertNotIn('jobs/a', dag.children['jobs/d'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import json
+import unittest
+
+try:
+    from services.PipelineGraph import assemble
+except ImportError as error:
+    raise unittest.SkipTest(f'pipeline dependencies are missing: {error}')
+
+
+def link(_from, key):
+    return {'_from': _from, 'job': {'_id': f'jobs/{key}', '_key': key, 'id': key}}
+
+
+def keys(nodes):
+    return [node['id'] for node in nodes]
+
+
+class AssembleTest(unittest.TestCase):
+
+    def test_shared_node(self):
+        links = [
+            link('pipeline/p', 'a'),
+            link('jobs/a', 'b'),
+            link('jobs/a', 'c'),
+            link('jobs/b', 'd'),
+            link('jobs/c', 'd'),
+        ]
+        roots = assemble('pipeline/p', links)
+
+        self.assertEqual(keys(roots), ['a'])
+        b, c = roots[0]['jobs']
+        self.assertEqual(keys(b['jobs']), ['d'])
+        # one node object under both parents, not a copy per path
+        self.assertIs(b['jobs'][0], c['jobs'][0])
+        json.dumps(roots)
+
+    def test_cycle_is_broken(self):
+        links = [
+            link('pipeline/p', 'a'),
+            link('jobs/a', 'b'),
+            link('jobs/b', 'a'),
+        ]
+        roots = assemble('pipeline/p', links)
+
+        self.assertEqual(keys(roots), ['a'])
+        self.assertEqual(keys(roots[0]['jobs']), ['b'])
+        self.assertEqual(roots[0]['jobs'][0]['jobs'], [])
+        # a circular structure would raise here
+        json.dumps(roots)
+
+    def test_depth_limit(self):
+        links = [link('pipeline/p', 'a'), link('jobs/a', 'b'), link('jobs/b', 'c')]
+        roots = assemble('pipeline/p', links, depth=2)
+        self.assertEqual(keys(roots[0]['jobs']), ['b'])
+        self.assertEqual(roots[0]['jobs'][0]['jobs'], [])
+
+    def test_duplicate_root_links(self):
+        links = [link('pipeline/p', 'a'), link('pipeline/p', 'a')]
+        self.assertEqual(keys(assemble('pipeline/p', links)), ['a'])
+
+    def test_unrelated_links_are_left_out(self):
+        links = [link('pipeline/p', 'a'), link('jobs/x', 'y')]
+        roots = assemble('pipeline/p', links)
+        self.assertEqual(keys(roots), ['a'])
+        self.assertEqual(roots[0]['jobs'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
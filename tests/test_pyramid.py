@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    import numpy as np
+    import services.Pyramid as Pyramid
+except ImportError as error:
+    raise unittest.SkipTest(f'pyramid dependencies are missing: {error}')
+
+
+class PyramidTest(unittest.TestCase):
+    # a 7x10 plane in 4 pixel tiles: levels of 10x7, 5x4 and 3x2
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.tile_size = mock.patch.object(Pyramid, 'tile_size', 4)
+        self.tile_size.start()
+        self.plane = np.arange(70, dtype=np.uint16).reshape(7, 10)
+        self.info = Pyramid.write([self.plane, self.plane * 2], self.folder)
+
+    def tearDown(self):
+        self.tile_size.stop()
+
+    def test_level_sizes(self):
+        levels = [(level['width'], level['height'], level['tiles_x'], level['tiles_y']) for level in self.info['levels']]
+        self.assertEqual(levels, [(10, 7, 3, 2), (5, 4, 2, 1), (3, 2, 1, 1)])
+        self.assertEqual(self.info['dtype'], 'uint16')
+        self.assertEqual(self.info['range'], [[0, 69], [0, 138]])
+
+    def test_edge_tiles(self):
+        # the last column and row of tiles are cut at the image border
+        planes = Pyramid.tile(self.folder, self.info, 2, 2, 1, [0, 1])
+        np.testing.assert_array_equal(planes[0], self.plane[4:7, 8:10])
+        np.testing.assert_array_equal(planes[1], self.plane[4:7, 8:10] * 2)
+
+    def test_coarse_level(self):
+        # odd edges repeat the last row or column before the 2x2 mean, each level is rounded to the dtype
+        padded = np.pad(self.plane.astype(np.float64), ((0, 1), (0, 0)), mode='edge')
+        half = np.rint(padded.reshape(4, 2, 5, 2).mean(axis=(1, 3)))
+        half = np.pad(half, ((0, 0), (0, 1)), mode='edge')
+        quarter = np.rint(half.reshape(2, 2, 3, 2).mean(axis=(1, 3))).astype(np.uint16)
+
+        planes = Pyramid.tile(self.folder, self.info, 0, 0, 0, [0])
+        np.testing.assert_array_equal(planes[0], quarter)
+
+    def test_region_across_tiles(self):
+        planes = Pyramid.region(self.folder, self.info, 2, 3, 1, 6, 5, [0])
+        np.testing.assert_array_equal(planes[0], self.plane[1:6, 3:9])
+
+    def test_region_clamped(self):
+        planes = Pyramid.region(self.folder, self.info, 2, 6, 2, 100, 100, [0])
+        np.testing.assert_array_equal(planes[0], self.plane[2:7, 6:10])
+
+        # the part left of and above the image is cut off, the window does not move
+        planes = Pyramid.region(self.folder, self.info, 2, -3, -2, 5, 4, [0])
+        np.testing.assert_array_equal(planes[0], self.plane[0:2, 0:2])
+
+        self.assertIsNone(Pyramid.region(self.folder, self.info, 2, -4, 0, 4, 4, [0]))
+
+    def test_downscale_keeps_dtype(self):
+        level = Pyramid._downscale(self.plane)
+        self.assertEqual(level.dtype, np.uint16)
+        self.assertEqual(level.shape, (4, 5))
+
+    def test_build_skipped_while_another_process_builds(self):
+        folder = os.path.join(self.folder, 'locked')
+        os.makedirs(folder)
+        with open(os.path.join(folder, '.build.lock'), 'a') as file, \
+                mock.patch.object(Pyramid, 'build') as build:
+            Pyramid.fcntl.flock(file, Pyramid.fcntl.LOCK_EX)
+            other = os.fork()
+            if other == 0:
+                # the child process does not get the lock and does not build
+                Pyramid._build_once('master.tif', folder, 0)
+                os._exit(1 if build.called else 0)
+            _, code = os.waitpid(other, 0)
+            self.assertEqual(code, 0)
+
+    def test_region_outside(self):
+        self.assertIsNone(Pyramid.region(self.folder, self.info, 2, 10, 0, 4, 4, [0]))
+        self.assertIsNone(Pyramid.region(self.folder, self.info, 3, 0, 0, 4, 4, [0]))
+
+    def test_no_partial_files(self):
+        names = [name for _, _, files in os.walk(self.folder) for name in files]
+        self.assertIn('manifest.json', names)
+        self.assertFalse([name for name in names if name.endswith('.part')])
+
+    def test_failed_build_is_retried_after_backoff(self):
+        folder = os.path.join(self.folder, 'failed')
+        with mock.patch.object(Pyramid, 'build', side_effect=OSError('broken')), \
+                mock.patch.object(Pyramid, 'retry', 60):
+            Pyramid._building[folder] = None
+            Pyramid._build('master.tif', folder, 0)
+
+            self.assertNotIn(folder, Pyramid._building)
+            failed_at, error = Pyramid._failed[folder]
+            self.assertEqual(error, 'broken')
+
+            entry = {'hash': 'failed', 'path': 'master.tif'}
+            with mock.patch.object(Pyramid, '_master', return_value=entry), \
+                    mock.patch.object(Pyramid, '_folder', return_value=folder), \
+                    mock.patch.object(Pyramid, '_executor') as executor:
+                self.assertEqual(Pyramid.manifest('1')[0], 'error')
+                executor.submit.assert_not_called()
+
+                Pyramid._failed[folder] = (failed_at - 61, error)
+                self.assertEqual(Pyramid.manifest('1')[0], 'building')
+                executor.submit.assert_called_once()
+
+        Pyramid._building.pop(folder, None)
+
+
+if __name__ == '__main__':
+    unittest.main()